@@ -0,0 +1,516 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|Micro-benchmarks for the parser and the database                                   |#
+#|python GEDCOM_Benchmark.py dispatch input/*.ged                                     |#
+#|python GEDCOM_Benchmark.py tokenize input/*.ged                                     |#
+#|python GEDCOM_Benchmark.py snapshot input/*.ged                                     |#
+#|python GEDCOM_Benchmark.py scale --sizes 1000 10000 100000 --json results.json     |#
+#|python GEDCOM_Benchmark.py lineage --sizes 10000 100000                             |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import io
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+
+import GEDCOM_Database as db
+import GEDCOM_Parser as parser
+import GEDCOM_Report as report
+import GEDCOM_Generator as generator
+import GEDCOM_Lineage as lineage
+from GEDCOM_Records import Individual, Family
+from GEDCOM_Dates import parseDate
+
+# parseLine before the dispatch table, tags are checked against the tagRules list
+def listParseLine(line):
+
+	valid = False
+	level = -1
+	tag = None
+	args = None
+
+	words = line.split()
+	if len(words) >= 2:
+
+		level = int(words[0])
+		badOrder = False
+
+		if (len(words) >= 3 and
+			(words[2] == 'INDI' or words[2] == 'FAM')):
+
+			tag = words[2]
+			args = [words[1]] + words[3:]
+
+		else:
+			tag = words[1]
+			args = words[2:]
+
+			if tag == 'INDI' or tag == 'FAM':
+				badOrder = True
+
+		valid = (not badOrder) and ((level, tag) in parser.tagRules)
+
+	return (valid, level, tag, args)
+
+# parseRecords before the dispatch table, every valid line goes through both if/elif chains
+def chainParseRecords(lines):
+
+	ind = Individual()
+	fam = Family()
+
+	lastTag = None
+
+	for line in lines:
+
+		(valid, level, newTag, args) = listParseLine(line)
+
+		if (valid):
+
+			if (level == 0):
+
+				if (ind.lastName != None):
+					yield ind
+					ind = Individual()
+
+				elif (fam.husbID != None):
+					yield fam
+					fam = Family()
+
+			if(newTag == 'INDI'):
+				ind.id = args[0]
+			elif (newTag == 'NAME'):
+				ind.lastName = args[-1][1:-1]
+				ind.firstName = " ".join(args[0:-1])
+			elif (newTag == 'SEX'):
+				ind.gender = args[0]
+			elif (lastTag == 'BIRT' and newTag == 'DATE'):
+				ind.birth = parseDate(" ".join(args))
+			elif (lastTag == 'DEAT' and newTag == 'DATE'):
+				ind.death = parseDate(" ".join(args))
+
+			if (newTag == 'FAM'):
+				fam.id = args[0]
+			elif (newTag == 'HUSB'):
+				fam.husbID = args[0]
+			elif (newTag == 'WIFE'):
+				fam.wifeID = args[0]
+			elif (newTag == 'CHIL'):
+				fam.children.append(args[0])
+			elif (lastTag == 'MARR' and newTag == 'DATE'):
+				fam.married = parseDate(" ".join(args))
+			elif (lastTag == 'DIV' and newTag == 'DATE'):
+				fam.divorced = parseDate(" ".join(args))
+
+			lastTag = newTag
+
+# Best time of repeat runs of function(), in seconds
+def bestTime(function, repeat):
+
+	best = None
+
+	for i in range(repeat):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+
+		if best is None or elapsed < best:
+			best = elapsed
+
+	return best
+
+# Lines per second through the old and the new record assembly
+def benchDispatch(filePaths, copies, repeat):
+
+	lines = []
+	for filePath in filePaths:
+		with open(filePath) as file:
+			lines.extend(file.read().splitlines())
+
+	lines = lines * copies
+
+	results = {}
+	for (name, parse) in (("if/elif", chainParseRecords), ("dispatch", parser.parseRecords)):
+		seconds = bestTime(lambda: sum(1 for record in parse(lines)), repeat)
+		results[name] = len(lines) / seconds
+		print("%-10s %12.0f lines/s" % (name, results[name]))
+
+	print("speedup    %12.2fx" % (results["dispatch"] / results["if/elif"]))
+
+	return results
+
+# Lines per second reading a file line by line and through a memory map
+def benchTokenize(filePaths, copies, repeat):
+
+	text = b""
+	for filePath in filePaths:
+		with open(filePath, 'rb') as file:
+			text += file.read().rstrip(b"\r\n") + b"\n"
+
+	(handle, tempPath) = tempfile.mkstemp(suffix=".ged")
+
+	try:
+		with os.fdopen(handle, 'wb') as file:
+			file.write(text * copies)
+
+		lineCount = text.count(b"\n") * copies
+
+		def readLines():
+			with open(tempPath) as file:
+				return sum(1 for record in parser.parseRecords(file))
+
+		def readMapped():
+			return sum(1 for record in parser.parseRecordsMapped(tempPath))
+
+		results = {}
+		for (name, read) in (("lines", readLines), ("mmap", readMapped)):
+			seconds = bestTime(read, repeat)
+			results[name] = lineCount / seconds
+			print("%-10s %12.0f lines/s" % (name, results[name]))
+
+		print("speedup    %12.2fx" % (results["mmap"] / results["lines"]))
+
+	finally:
+		os.remove(tempPath)
+
+	return results
+
+# Tags whose first argument is an individual or family ID
+idTags = {'HUSB', 'WIFE', 'CHIL', 'FAMC', 'FAMS'}
+
+# The lines repeated copies times, with the IDs of each copy made unique
+def scaleLines(lines, copies):
+
+	scaled = []
+
+	for copy in range(copies):
+
+		suffix = "-" + str(copy)
+
+		for line in lines:
+			words = line.split()
+
+			if len(words) >= 3 and (words[2] == 'INDI' or words[2] == 'FAM'):
+				words[1] += suffix
+			elif len(words) >= 3 and words[1] in idTags:
+				words[2] += suffix
+
+			scaled.append(" ".join(words))
+
+	return scaled
+
+# Seconds to load the files by parsing their text and by importing a snapshot of the result
+def benchSnapshot(filePaths, copies, repeat):
+
+	lines = []
+	for filePath in filePaths:
+		with open(filePath) as file:
+			lines.extend(scaleLines(file.read().splitlines(), copies))
+
+	def parseText():
+		database = db.dbInit(":memory:")
+
+		# the sample files share IDs, don't print every duplicate
+		with contextlib.redirect_stdout(io.StringIO()):
+			parser.parseLines(database, lines, validate=lambda conn: True)
+
+		return database
+
+	(handle, snapshotPath) = tempfile.mkstemp(suffix=".snap")
+	os.close(handle)
+
+	try:
+		counts = db.exportSnapshot(parseText(), snapshotPath)
+
+		def importSnapshot():
+			db.importSnapshot(db.dbInit(":memory:"), snapshotPath)
+
+		results = {"text": bestTime(parseText, repeat), "snapshot": bestTime(importSnapshot, repeat)}
+
+		print("%d individuals, %d families, %d child links" %
+			(counts["individuals"], counts["families"], counts["children"]))
+		print("text       %10.3f s  %10d bytes" % (results["text"], sum(len(line) + 1 for line in lines)))
+		print("snapshot   %10.3f s  %10d bytes" % (results["snapshot"], os.path.getsize(snapshotPath)))
+		print("speedup    %10.2fx" % (results["text"] / results["snapshot"]))
+
+	finally:
+		os.remove(snapshotPath)
+
+	return results
+
+# The phases of the scaling benchmark, in order, as (name, function(workDir, state))
+# Each phase reads what the ones before it left in state
+def generatePhase(workDir, state):
+	state["lines"] = generator.writeTree(state["path"], state["individuals"], state["seed"], state["anomalies"])
+
+def parsePhase(workDir, state):
+	with open(state["path"]) as file:
+		state["records"] = sum(1 for record in parser.parseRecords(file))
+
+def loadPhase(workDir, state):
+
+	dbPath = os.path.join(workDir, "GEDCOM.db")
+	state["database"] = db.dbInit(dbPath, fastLoad=True)
+
+	with open(state["path"]) as file:
+		parser.loadRecords(state["database"], parser.parseRecords(file))
+
+def validatePhase(workDir, state):
+	db.validateDatabase(state["database"])
+
+def reportPhase(workDir, state):
+	with open(os.devnull, "w") as out:
+		parser.printDatabase(state["database"], state["format"], out)
+
+scalePhases = [
+	("generate", generatePhase),
+	("parse", parsePhase),
+	("load", loadPhase),
+	("validate", validatePhase),
+	("report", reportPhase)
+]
+
+# Run every phase for a tree of the given size, returns {phase: seconds}
+# With memory, tracemalloc runs too and the peak bytes of each phase are returned instead
+def runPhases(individuals, seed, anomalies, format, memory):
+
+	results = {}
+
+	with tempfile.TemporaryDirectory() as workDir:
+
+		state = {
+			"path": os.path.join(workDir, "tree.ged"),
+			"individuals": individuals,
+			"seed": seed,
+			"anomalies": anomalies,
+			"format": format
+		}
+
+		try:
+			for (name, phase) in scalePhases:
+
+				if memory:
+					tracemalloc.start()
+
+				start = time.perf_counter()
+
+				# anomalies, lists and rejected records would flood the terminal
+				with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+					phase(workDir, state)
+
+				elapsed = time.perf_counter() - start
+
+				if memory:
+					results[name] = tracemalloc.get_traced_memory()[1]
+					tracemalloc.stop()
+				else:
+					results[name] = elapsed
+
+			if not memory:
+				results["lines"] = state["lines"]
+				results["bytes"] = os.path.getsize(state["path"])
+				results["records"] = state["records"]
+
+		finally:
+			if "database" in state:
+				state["database"].close()
+
+	return results
+
+# Time and peak memory of each phase (generate, parse, load, validate, report) for
+# generated trees of each size. Times come from a run without tracemalloc, which slows
+# everything down, peaks from a second run with it (skipped with memory=False).
+# Returns the results, and saves them as JSON to jsonPath if given
+def benchScale(sizes, seed, anomalies, format, memory, jsonPath):
+
+	runs = []
+
+	for individuals in sizes:
+
+		times = runPhases(individuals, seed, anomalies, format, False)
+		peaks = runPhases(individuals, seed, anomalies, format, True) if memory else {}
+
+		run = {
+			"individuals": individuals,
+			"lines": times.pop("lines"),
+			"bytes": times.pop("bytes"),
+			"records": times.pop("records"),
+			"phases": {}
+		}
+
+		for (name, phase) in scalePhases:
+			run["phases"][name] = {"seconds": times[name], "peakBytes": peaks.get(name)}
+
+			print("%10d  %-10s %10.3f s %12s" % (individuals, name, times[name],
+				"" if name not in peaks else "%.1f MB" % (peaks[name] / 1e6)))
+
+		runs.append(run)
+
+	results = {
+		"seed": seed,
+		"anomalies": anomalies,
+		"format": format,
+		"python": platform.python_version(),
+		"sqlite": sqlite3.sqlite_version,
+		"platform": platform.platform(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"runs": runs
+	}
+
+	if jsonPath:
+		with open(jsonPath, "w") as file:
+			json.dump(results, file, indent="\t")
+
+	return results
+
+# Every ancestor of an individual with a recursive query, what GEDCOM_Lineage replaces
+ancestorsQuery = '''
+		WITH RECURSIVE ancestors(id, generation) AS (
+			SELECT ?, 0
+			UNION
+			SELECT parent.id, ancestors.generation + 1
+			FROM
+				ancestors
+				INNER JOIN children ON children.childID == ancestors.id
+				INNER JOIN families ON families.id == children.famID
+				INNER JOIN individuals AS parent
+				ON parent.id == families.husbID OR parent.id == families.wifeID
+		)
+		SELECT id, MIN(generation) FROM ancestors WHERE generation > 0 GROUP BY id
+	'''
+
+# Seconds to build the lineage index of generated deep trees (see GEDCOM_Generator.deepChildCounts),
+# then to find the ancestors of a sample of individuals with it and with a recursive query,
+# the relationship of random pairs and every marriage of first cousins or closer
+def benchLineage(sizes, seed, samples, deep=True):
+
+	results = []
+
+	for individuals in sizes:
+
+		database = db.dbInit(":memory:")
+		lines = generator.generateLines(individuals, seed, {"US18": 0.01, "US19": 0.2}, deep)
+
+		parser.loadRecords(database, parser.parseRecords(lines))
+
+		start = time.perf_counter()
+		index = lineage.loadLineage(database)
+		built = time.perf_counter() - start
+
+		sample = random.Random(seed).sample(index.ids, min(samples, len(index)))
+		pairs = list(zip(sample, reversed(sample)))
+
+		start = time.perf_counter()
+		found = sum(len(index.ancestors(indID)) for indID in sample)
+		indexed = time.perf_counter() - start
+
+		start = time.perf_counter()
+		queried = sum(len(database.execute(ancestorsQuery, (indID,)).fetchall()) for indID in sample)
+		recursive = time.perf_counter() - start
+
+		if found != queried:
+			raise AssertionError("the index found %d ancestors, the query %d" % (found, queried))
+
+		start = time.perf_counter()
+		for (idA, idB) in pairs:
+			index.relationship(idA, idB)
+		kinship = time.perf_counter() - start
+
+		start = time.perf_counter()
+		marriages = sum(1 for marriage in index.cousinMarriages())
+		cousins = time.perf_counter() - start
+
+		generations = max(max([depth for (indID, depth) in index.ancestors(indID)], default=0) for indID in sample)
+
+		run = {
+			"individuals": len(index),
+			"generations": generations,
+			"build": built,
+			"ancestors": indexed,
+			"ancestorsQuery": recursive,
+			"kinship": kinship,
+			"cousinMarriages": cousins,
+			"marriagesFound": marriages
+		}
+		results.append(run)
+
+		database.close()
+
+		print("%d individuals, %d generations deep, %d cousin marriages" % (len(index), generations, marriages))
+		print("build index          %10.3f s" % built)
+		print("ancestors x%-8d %10.3f s  (recursive query %.3f s, %.1fx)" %
+			(len(sample), indexed, recursive, recursive / indexed if indexed else 0))
+		print("relationship x%-5d %10.3f s" % (len(pairs), kinship))
+		print("cousin marriages     %10.3f s" % cousins)
+
+	return results
+
+if __name__ == "__main__":
+
+	argParser = argparse.ArgumentParser(description="Parser and database micro-benchmarks")
+	commands = argParser.add_subparsers(dest="command", required=True)
+
+	dispatchCommand = commands.add_parser("dispatch",
+		help="lines per second through parseRecords, with and without the tag dispatch table")
+	dispatchCommand.add_argument("files", nargs="+", help="GEDCOM files to read")
+	dispatchCommand.add_argument("--copies", type=int, default=200,
+		help="how many times the lines are repeated (default: 200)")
+	dispatchCommand.add_argument("--repeat", type=int, default=5,
+		help="runs per engine, the best is reported (default: 5)")
+
+	tokenizeCommand = commands.add_parser("tokenize",
+		help="lines per second reading a file line by line and through a memory map")
+	tokenizeCommand.add_argument("files", nargs="+", help="GEDCOM files to read")
+	tokenizeCommand.add_argument("--copies", type=int, default=200,
+		help="how many times the files are repeated (default: 200)")
+	tokenizeCommand.add_argument("--repeat", type=int, default=5,
+		help="runs per tokenizer, the best is reported (default: 5)")
+
+	snapshotCommand = commands.add_parser("snapshot",
+		help="seconds to load the files from text and from a binary snapshot")
+	snapshotCommand.add_argument("files", nargs="+", help="GEDCOM files to read")
+	snapshotCommand.add_argument("--copies", type=int, default=500,
+		help="how many copies of each file, with their own IDs (default: 500)")
+	snapshotCommand.add_argument("--repeat", type=int, default=3,
+		help="runs per loader, the best is reported (default: 3)")
+
+	scaleCommand = commands.add_parser("scale",
+		help="time and peak memory of each phase for generated trees of growing size")
+	scaleCommand.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+		help="individuals in each tree (default: 1000 10000 100000)")
+	scaleCommand.add_argument("--seed", type=int, default=0, help="generator seed (default: 0)")
+	scaleCommand.add_argument("--anomaly", type=generator.anomalyArgument, action="append", default=[],
+		metavar="STORY=RATE", help="inject anomalies, as in GEDCOM_Generator.py (may be repeated)")
+	scaleCommand.add_argument("--format", choices=sorted(report.reportFormats), default="fixed",
+		help="report format (default: fixed)")
+	scaleCommand.add_argument("--no-memory", dest="memory", action="store_false",
+		help="skip the tracemalloc run that measures peak memory")
+	scaleCommand.add_argument("--json", default=None, help="save the results to this file")
+
+	lineageCommand = commands.add_parser("lineage",
+		help="lineage index build time and ancestor, relationship and cousin marriage queries on deep trees")
+	lineageCommand.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000],
+		help="individuals in each tree (default: 10000 100000)")
+	lineageCommand.add_argument("--seed", type=int, default=0, help="generator seed (default: 0)")
+	lineageCommand.add_argument("--samples", type=int, default=200,
+		help="individuals whose ancestors are looked up (default: 200)")
+	lineageCommand.add_argument("--wide", dest="deep", action="store_false",
+		help="use the generator's usual family sizes instead of a deep tree")
+
+	args = argParser.parse_args()
+
+	if args.command == "dispatch":
+		benchDispatch(args.files, args.copies, args.repeat)
+	elif args.command == "tokenize":
+		benchTokenize(args.files, args.copies, args.repeat)
+	elif args.command == "snapshot":
+		benchSnapshot(args.files, args.copies, args.repeat)
+	elif args.command == "scale":
+		benchScale(args.sizes, args.seed, dict(args.anomaly), args.format, args.memory, args.json)
+	elif args.command == "lineage":
+		benchLineage(args.sizes, args.seed, args.samples, args.deep)
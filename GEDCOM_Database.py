@@ -1,24 +1,92 @@
 import sqlite3
 from datetime import datetime
 import os
-import string
+import itertools
+import struct
+import queue
+import urllib.parse
+import concurrent.futures
+
+import GEDCOM_Stats as stats
+import GEDCOM_Sinks as sinks
+from GEDCOM_Records import Individual, Family, Anomaly
+from GEDCOM_Dates import isoText
+
+# Trade durability for load speed: keep the rollback journal in memory and
+# don't wait for the disk after each commit. Only for databases that can be
+# rebuilt from the GEDCOM files, a crash mid-load can corrupt them.
+def setFastLoad(conn):
 
-# Call this function to initialize the database tables
-def dbInit(dbName):
+	curs = conn.cursor()
 
-	# Delete the database if it already exists
-	try:
-		os.remove(dbName)
-	except FileNotFoundError:
-		pass
+	curs.execute("PRAGMA journal_mode = MEMORY")
+	curs.execute("PRAGMA synchronous = OFF")
+
+# Write-ahead log: readers on other connections (see ReaderPool) see the last commit
+# and don't block the writer, the writer doesn't block them. Needs a database file.
+def setWal(conn):
+
+	conn.cursor().execute("PRAGMA journal_mode = WAL")
+
+# Secondary indexes for the columns the reports and validation rules join and sort on
+indexes = [
+	# children of a family (getChildren, US16, US32, US33)
+	'CREATE INDEX IF NOT EXISTS childrenFam ON children (famID)',
+	# spouse lookups (US02, US05, US21, US30, US34)
+	'CREATE INDEX IF NOT EXISTS familiesHusb ON families (husbID)',
+	'CREATE INDEX IF NOT EXISTS familiesWife ON families (wifeID)',
+	# ordering by birthday (getIndividuals, getChildren, US01)
+	'CREATE INDEX IF NOT EXISTS individualsBirth ON individuals (birth)',
+	# same name and birthday (US23)
+	'CREATE INDEX IF NOT EXISTS individualsNameBirth ON individuals (firstName, lastName, birth)',
+	# records loaded from a file (removeSource)
+	'CREATE INDEX IF NOT EXISTS recordSourcesSource ON recordSources (source)'
+]
+
+# Build the secondary indexes
+# Call this after a bulk load if the database was created with deferIndexes
+def createIndexes(conn):
+
+	curs = conn.cursor()
+
+	for sql in indexes:
+		curs.execute(sql)
+
+	conn.commit()
+
+# Call this function to initialize the database tables
+# fastLoad turns on setFastLoad for throwaway databases
+# deferIndexes leaves out the secondary indexes so a bulk load doesn't have to
+# keep them up to date row by row, call createIndexes once it is done
+# persistent keeps an existing database and what was loaded into it, so files that
+# haven't changed since don't have to be loaded again (see getSource)
+# wal turns on setWal, for databases read through a ReaderPool
+def dbInit(dbName, fastLoad=False, deferIndexes=False, persistent=False, wal=False):
+
+	# Delete the database if it already exists (with the log of a write-ahead log mode one)
+	if not persistent:
+		for path in (dbName, dbName + "-wal", dbName + "-shm"):
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
 
 	conn = sqlite3.connect(dbName)
 	curs = conn.cursor()
 
+	if stats.enabled:
+		stats.watchQueries(conn)
+
 	curs.execute("PRAGMA foreign_keys = ON")
 
+	if fastLoad:
+		setFastLoad(conn)
+
+	if wal:
+		setWal(conn)
+
 	# Individuals table
-	curs.execute('''CREATE TABLE individuals (
+	curs.execute('''CREATE TABLE IF NOT EXISTS individuals (
 		id 			TEXT	PRIMARY KEY,
 		firstName	TEXT,
 		lastName 	TEXT,
@@ -28,7 +96,7 @@ def dbInit(dbName):
 	)''')
 
 	# Families table
-	curs.execute('''CREATE TABLE families (
+	curs.execute('''CREATE TABLE IF NOT EXISTS families (
 		id 			TEXT	PRIMARY KEY,
 		married		DATE,
 		divorced 	DATE,
@@ -37,46 +105,187 @@ def dbInit(dbName):
 	)''')
 
 	# Children table (associates individuals with a family as a child
-	curs.execute('''CREATE TABLE children (
+	curs.execute('''CREATE TABLE IF NOT EXISTS children (
 		childID		TEXT,
 		famID		TEXT,
 
 		PRIMARY KEY (childID, famID)
 	)''')
 
+	# Sources table (the files loaded so far, with the digest and size of what was loaded)
+	curs.execute('''CREATE TABLE IF NOT EXISTS sources (
+		path		TEXT	PRIMARY KEY,
+		digest		TEXT,
+		size		INTEGER
+	)''')
+
+	# Record sources table (which file each row came from)
+	# kind is 'individual', 'family' or 'child', famID is only set for children
+	curs.execute('''CREATE TABLE IF NOT EXISTS recordSources (
+		source		TEXT,
+		kind		TEXT,
+		id			TEXT,
+		famID		TEXT
+	)''')
+
+	if not deferIndexes:
+		createIndexes(conn)
+
+	trackingInit(conn)
+
 	conn.commit()
 
 	return conn
 
-# Add an individual to the DB
-# Prints error and returns false if invalid
-def addIndividual (conn, idStr, firstName, lastName, gender, birth, death):
+# A few read-only connections to a database (created by dbInit with wal) and a thread for each,
+# so independent queries can run at the same time while another connection keeps writing
+# Each query sees the database as of the writer's last commit
+class ReaderPool:
+
+	def __init__(self, dbName, size=4):
+
+		self.connections = queue.Queue()
+
+		for i in range(size):
+			uri = "file:" + urllib.parse.quote(os.path.abspath(dbName)) + "?mode=ro"
+			conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+			self.connections.put(conn)
+
+		self.threads = concurrent.futures.ThreadPoolExecutor(size)
+		self.size = size
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+
+	# function(conn, item) for every item, each on whichever connection is free
+	# Returns the results in the order of items, whatever order they finish in
+	def map(self, function, items):
+
+		return list(self.threads.map(lambda item: self.run(function, item), items))
+
+	# function(conn, item) on a connection nobody else is using
+	def run(self, function, item):
+
+		conn = self.connections.get()
+
+		try:
+			return function(conn, item)
+		finally:
+			self.connections.put(conn)
+
+	def close(self):
+
+		self.threads.shutdown()
+
+		for i in range(self.size):
+			self.connections.get().close()
+
+# Rows of each query, the queries run at the same time on the pool's connections
+# Returns a list of rows per query, in the order of queries
+def queryAll(pool, queries):
+
+	return pool.map(lambda conn, sql: conn.cursor().execute(sql).fetchall(), queries)
+
+# Check the fields of an individual before it is added
+# indExists is a function telling whether an individual ID is already taken
+# Passes the error to onError (default: print it) and returns false if invalid
+def checkIndividual (conn, idStr, firstName, lastName, gender, birth, death, indExists, onError=print):
 
 	if conn is None:
-		print("ERROR: INDIVIDUAL: Can't add individual, bad database paramter")
+		onError("ERROR: INDIVIDUAL: Can't add individual, bad database paramter")
 		return False
 	if idStr is None:
-		print("ERROR: INDIVIDUAL: Can't add individual, missing indiviudal ID")
+		onError("ERROR: INDIVIDUAL: Can't add individual, missing indiviudal ID")
 		return False
 	if firstName is None:
-		print("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", no first name")
+		onError("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", no first name")
 		return False
 	if lastName is None:
-		print("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", no last name")
+		onError("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", no last name")
 		return False
 	if gender is None:
-		print("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", gender missing gender")
+		onError("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", gender missing gender")
 		return False
 	if gender.lower() != 'm' and gender.lower() != 'f':
-		print("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", bad gender tag")
+		onError("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", bad gender tag")
 		return False
 	if birth is None:
-		print("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", no birthday")
+		onError("ERROR: INDIVIDUAL: Can't add individual " + idStr + ", no birthday")
 		return False
 	#US22 - Unique IDs
-	if not (getIndividual(conn, idStr) is None):
-		print("ERROR: US22: INDIVIDUAL: Can't add individual " + idStr + ", duplicate of existing individual ID")
+	if indExists(idStr):
+		onError("ERROR: US22: INDIVIDUAL: Can't add individual " + idStr + ", duplicate of existing individual ID")
 		return False
+
+	return True
+
+# Check the fields of a family before it is added
+# Passes the error to onError (default: print it) and returns false if invalid
+def checkFamily (conn, idStr, married, divorced, husbID, wifeID, onError=print):
+
+	if conn is None:
+		onError("ERROR: FAMILY: Can't add Family, bad database paramter")
+		return False
+	if idStr is None:
+ 		onError("ERROR: FAMILY: Can't add Family, family ID missing")
+ 		return False
+	if married is None:
+ 		onError("ERROR: FAMILY: Can't add Family " + idStr + ", no marriage date")
+ 		return False
+	if husbID is None:
+ 		onError("ERROR: FAMILY: Can't add Family " + idStr + ", no individual ID for husband.")
+ 		return False
+	if wifeID is None:
+ 		onError("ERROR: FAMILY: Can't add Family " + idStr + ", no individual ID for wife.")
+ 		return False
+
+	return True
+
+# Check the IDs a family refers to (spouses must exist, its own ID must be new)
+# indExists and famExists tell whether an individual or family ID is already taken
+# Passes the error to onError (default: print it) and returns false if invalid
+def checkFamilyLinks (idStr, husbID, wifeID, indExists, famExists, onError=print):
+
+	if not indExists(wifeID):
+		onError("ERROR: FAMILY: Can't add Family " + idStr + ", wife does not exist")
+		return False
+	if not indExists(husbID):
+		onError("ERROR: FAMILY: Can't add Family " + idStr + ", husband does not exist")
+		return False
+	#US22 - Unique IDs
+	if famExists(idStr):
+		onError("ERROR: US22: FAMILY: Can't add family " + idStr + ", duplicate of existing family ID")
+		return False
+
+	return True
+
+# Check the fields of a child link before it is added
+# Passes the error to onError (default: print it) and returns false if invalid
+def checkChild (conn, childID, famID, onError=print):
+
+	if conn is None:
+		onError("ERROR: CHILD: Can't add Child, bad database paramter")
+		return False
+	if childID is None:
+		onError("ERROR: CHILD: Can't add Child, missing Child ID")
+		return False
+	if famID is None:
+		onError("ERROR: CHILD: Can't add Child, missing Family ID")
+		return False
+
+	return True
+
+# Add an individual to the DB
+# Prints error and returns false if invalid
+def addIndividual (conn, idStr, firstName, lastName, gender, birth, death):
+
+	if not checkIndividual(conn, idStr, firstName, lastName, gender, birth, death,
+		lambda indID: getIndividual(conn, indID) is not None):
+		return False
+
 	try:
 		conn.cursor().execute(
 			'INSERT INTO individuals VALUES (?, ?, ?, ?, ?, ?)',
@@ -87,6 +296,9 @@ def addIndividual (conn, idStr, firstName, lastName, gender, birth, death):
 		print("Couldn't add individual " + str(idStr) + ": " + str(err))
 		return False
 
+	trackingInit(conn)
+	touchIndividuals(conn, [idStr])
+
 	conn.commit()
 
 	return True
@@ -96,31 +308,13 @@ def addIndividual (conn, idStr, firstName, lastName, gender, birth, death):
 # Prints error and returns false if invalid
 def addFamily (conn, idStr, married, divorced, husbID, wifeID):
 
-	if conn is None:
-		print("ERROR: FAMILY: Can't add Family, bad database paramter")
+	if not checkFamily(conn, idStr, married, divorced, husbID, wifeID):
 		return False
-	if idStr is None:
- 		print("ERROR: FAMILY: Can't add Family, family ID missing")
- 		return False
-	if married is None:
- 		print("ERROR: FAMILY: Can't add Family " + idStr + ", no marriage date")
- 		return False
-	if husbID is None:
- 		print("ERROR: FAMILY: Can't add Family " + idStr + ", no individual ID for husband.")
- 		return False
-	if wifeID is None:
- 		print("ERROR: FAMILY: Can't add Family " + idStr + ", no individual ID for wife.")
- 		return False
-	if (getIndividual(conn, wifeID) is None):
-		print("ERROR: FAMILY: Can't add Family " + idStr + ", wife does not exist")
-		return False
-	if (getIndividual(conn, husbID) is None):
-		print("ERROR: FAMILY: Can't add Family " + idStr + ", husband does not exist")
-		return False
-	#US22 - Unique IDs
-	if not (getFamily(conn, idStr) is None):
-		print("ERROR: US22: FAMILY: Can't add family " + idStr + ", duplicate of existing family ID")
+	if not checkFamilyLinks(idStr, husbID, wifeID,
+		lambda indID: getIndividual(conn, indID) is not None,
+		lambda famID: getFamily(conn, famID) is not None):
 		return False
+
 	try:
 		conn.cursor().execute(
 			'INSERT INTO families VALUES (?, ?, ?, ?, ?)',
@@ -131,6 +325,9 @@ def addFamily (conn, idStr, married, divorced, husbID, wifeID):
 		print("Couldn't add family " + str(idStr) + ": " + str(err))
 		return False
 
+	trackingInit(conn)
+	touchFamilies(conn, [idStr])
+
 	conn.commit()
 
 	return True
@@ -141,14 +338,7 @@ def addFamily (conn, idStr, married, divorced, husbID, wifeID):
 # Prints error and returns false if invalid
 def addChild (conn, childID, famID):
 
-	if conn is None:
-		print("ERROR: CHILD: Can't add Child, bad database paramter")
-		return False
-	if childID is None:
-		print("ERROR: CHILD: Can't add Child, missing Child ID")
-		return False
-	if famID is None:
-		print("ERROR: CHILD: Can't add Child, missing Family ID")
+	if not checkChild(conn, childID, famID):
 		return False
 
 	try:
@@ -161,171 +351,785 @@ def addChild (conn, childID, famID):
 		print("Couldn't add child " + str(childID) + ": " + str(err))
 		return False
 
+	trackingInit(conn)
+	touchIndividuals(conn, [childID])
+	touchFamilies(conn, [famID])
+
 	conn.commit()
 
 	return True
 
 
-# Get a list of all invdividuals as tuples
+# Loads many records at once
+# Records are checked as they are added (same errors as addIndividual, addFamily and addChild),
+# buffered, then written with executemany and a single commit per chunk.
+# chunkSize is the number of buffered rows that triggers a write, None buffers everything
+# until close(). Rows the database still rejects are reported one by one.
+# Families are only staged until close(), then their spouse and duplicate checks run
+# in one pass, so they may come before the individuals they refer to.
+# source is the file the records come from, every row written is listed under it in
+# recordSources so removeSource can take them out again
+# onError is called with the message of every rejected record (default: print it)
+class BulkLoader:
+
+	def __init__(self, conn, chunkSize=10000, source=None, onError=print):
+
+		self.conn = conn
+		self.chunkSize = chunkSize
+		self.source = source
+		self.onError = onError
+		self.noErrors = True
+
+		self.individuals = []
+		self.families = []
+		self.children = []
+
+		# Families waiting for every individual to be known
+		self.stagedFamilies = []
+
+		trackingInit(conn)
+
+		# Every individual and family ID in the database or in the buffers,
+		# read once on first use so duplicate and spouse checks don't need a query each
+		self.indIDs = None
+		self.famIDs = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.conn.rollback()
+
+	def indExists(self, indID):
+
+		if self.indIDs is None:
+			self.indIDs = getIndividualIDs(self.conn)
+
+		return indID in self.indIDs
+
+	def famExists(self, famID):
+
+		if self.famIDs is None:
+			self.famIDs = getFamilyIDs(self.conn)
+
+		return famID in self.famIDs
+
+	# Takes an Individual record
+	def addIndividual(self, ind):
+
+		if not checkIndividual(self.conn, ind.id, ind.firstName, ind.lastName, ind.gender, ind.birth, ind.death, self.indExists,
+			self.onError):
+			return False
+
+		self.individuals.append(ind)
+		self.indIDs.add(ind.id)
+		self.checkChunk()
+
+		return True
+
+	# Takes a Family record, its children are added separately with addChild
+	def addFamily(self, fam):
+
+		if not checkFamily(self.conn, fam.id, fam.married, fam.divorced, fam.husbID, fam.wifeID, self.onError):
+			return False
+
+		self.stagedFamilies.append(fam)
+
+		return True
+
+	def addChild(self, childID, famID):
+
+		if not checkChild(self.conn, childID, famID, self.onError):
+			return False
+
+		self.children.append((childID, famID))
+		self.checkChunk()
+
+		return True
+
+	def checkChunk(self):
+
+		if self.chunkSize is None:
+			return
+
+		if len(self.individuals) + len(self.families) + len(self.children) >= self.chunkSize:
+			self.flush()
+
+	# Write everything buffered so far in one transaction
+	# Returns false if any row was rejected by the database
+	def flush(self):
+
+		with stats.timer("load.insert"):
+			self.insertChunk(self.conn.cursor())
+
+		with stats.timer("load.commit"):
+			self.conn.commit()
+
+		stats.count("inserted.individuals", len(self.individuals))
+		stats.count("inserted.families", len(self.families))
+		stats.count("inserted.children", len(self.children))
+
+		self.individuals = []
+		self.families = []
+		self.children = []
+
+		return self.noErrors
+
+	# Insert the buffered rows, the ones the database rejects are taken out of the buffers
+	def insertChunk(self, curs):
+
+		try:
+			curs.executemany('INSERT INTO individuals VALUES (?, ?, ?, ?, ?, ?)', self.individuals)
+			curs.executemany('INSERT INTO families VALUES (?, ?, ?, ?, ?)', self.families)
+			curs.executemany('INSERT INTO children VALUES (?, ?)', self.children)
+
+		except sqlite3.IntegrityError:
+
+			# Something in the chunk was bad, redo it a row at a time to find out what
+			self.conn.rollback()
+			self.individuals = self.insertEach(curs,
+				'INSERT INTO individuals VALUES (?, ?, ?, ?, ?, ?)', self.individuals, "individual", self.indIDs)
+			self.families = self.insertEach(curs,
+				'INSERT INTO families VALUES (?, ?, ?, ?, ?)', self.families, "family", self.famIDs)
+			self.children = self.insertEach(curs,
+				'INSERT INTO children VALUES (?, ?)', self.children, "child", set())
+
+		if self.source is not None:
+			curs.executemany('INSERT INTO recordSources VALUES (?, ?, ?, ?)',
+				[(self.source, 'individual', ind.id, None) for ind in self.individuals] +
+				[(self.source, 'family', fam.id, None) for fam in self.families] +
+				[(self.source, 'child', childID, famID) for (childID, famID) in self.children])
+
+		# Let the next validation know what changed
+		touchIndividuals(self.conn, [ind.id for ind in self.individuals] + [childID for (childID, famID) in self.children])
+		touchFamilies(self.conn, [fam.id for fam in self.families] + [famID for (childID, famID) in self.children])
+
+	# Insert rows one at a time, returns the rows that made it in
+	# The IDs of the rejected rows are taken out of ids
+	def insertEach(self, curs, sql, rows, kind, ids):
+
+		inserted = []
+
+		for row in rows:
+			try:
+				curs.execute(sql, row)
+				inserted.append(row)
+
+			except sqlite3.IntegrityError as err:
+				self.onError("Couldn't add " + kind + " " + str(row[0]) + ": " + str(err))
+				self.noErrors = False
+				ids.discard(row[0])
+
+		return inserted
+
+	# Check the staged families against every known individual and family ID
+	# and queue the good ones for writing, in the order they were added
+	def resolveFamilies(self):
+
+		for fam in self.stagedFamilies:
+
+			if not checkFamilyLinks(fam.id, fam.husbID, fam.wifeID, self.indExists, self.famExists, self.onError):
+				self.noErrors = False
+				continue
+
+			self.families.append(fam)
+			self.famIDs.add(fam.id)
+			self.checkChunk()
+
+		self.stagedFamilies = []
+
+	# Write whatever is left, returns false if any record was rejected
+	def close(self):
+
+		self.resolveFamilies()
+
+		return self.flush()
+
+
+# The (digest, size) a file was loaded with, None if it hasn't been loaded
+def getSource(conn, path):
+
+	return conn.cursor().execute(
+		'SELECT digest, size FROM sources WHERE path == ?',
+		(path,)
+	).fetchone()
+
+# Remember that a file was loaded, with the digest and size of its contents
+def setSource(conn, path, digest, size):
+
+	conn.cursor().execute(
+		'INSERT OR REPLACE INTO sources VALUES (?, ?, ?)',
+		(path, digest, size)
+	)
+
+	conn.commit()
+
+# Take out every row a file added, so it can be loaded again
+# The records they were linked to are checked again by the next incremental validation
+def removeSource(conn, path):
+
+	curs = conn.cursor()
+
+	trackingInit(conn)
+
+	# the spouses and children of the families going away, and the records themselves
+	curs.execute('''
+		INSERT OR IGNORE INTO temp.touchedIndividuals
+		SELECT id FROM recordSources WHERE source == ? AND kind IN ('individual', 'child')
+		UNION
+		SELECT families.husbID FROM families INNER JOIN recordSources
+		ON families.id == recordSources.id WHERE source == ? AND kind == 'family'
+		UNION
+		SELECT families.wifeID FROM families INNER JOIN recordSources
+		ON families.id == recordSources.id WHERE source == ? AND kind == 'family'
+	''', (path, path, path))
+
+	curs.execute('''
+		INSERT OR IGNORE INTO temp.touchedFamilies
+		SELECT id FROM recordSources WHERE source == ? AND kind == 'family'
+		UNION
+		SELECT famID FROM recordSources WHERE source == ? AND kind == 'child'
+	''', (path, path))
+
+	curs.execute('''
+		DELETE FROM children WHERE (childID, famID) IN
+		(SELECT id, famID FROM recordSources WHERE source == ? AND kind == 'child')
+	''', (path,))
+	curs.execute('''
+		DELETE FROM families WHERE id IN
+		(SELECT id FROM recordSources WHERE source == ? AND kind == 'family')
+	''', (path,))
+	curs.execute('''
+		DELETE FROM individuals WHERE id IN
+		(SELECT id FROM recordSources WHERE source == ? AND kind == 'individual')
+	''', (path,))
+
+	curs.execute('DELETE FROM recordSources WHERE source == ?', (path,))
+	curs.execute('DELETE FROM sources WHERE path == ?', (path,))
+
+	conn.commit()
+
+# Yield the rows of an executed cursor as SQLite hands them over, batchSize rows per fetch
+# (default: the cursor's arraysize), instead of building the whole list first
+def iterRows(curs, batchSize=None):
+
+	if batchSize:
+		curs.arraysize = batchSize
+
+	while True:
+		rows = curs.fetchmany()
+
+		if not rows:
+			break
+
+		yield from rows
+
+# Run a query and yield its rows as they are read (see iterRows)
+def iterQuery(conn, sql, params=(), batchSize=None):
+
+	return iterRows(conn.cursor().execute(sql, params), batchSize)
+
+# Yield every record from pages of up to limit records, page(conn, afterID, limit) is one of
+# the page* functions below. Only one page is held at a time and no read is left open between pages.
+def iterPages(conn, page, limit=1000):
+
+	afterID = None
+
+	while True:
+		records = page(conn, afterID, limit)
+
+		yield from records
+
+		if len(records) < limit:
+			break
+
+		afterID = records[-1][0]
+
+# A cursor that returns Individual records
+def individualCursor(conn):
+
+	curs = conn.cursor()
+	curs.row_factory = Individual.fromRow
+
+	return curs
+
+# A cursor that returns Family records (without their children)
+def familyCursor(conn):
+
+	curs = conn.cursor()
+	curs.row_factory = Family.fromRow
+
+	return curs
+
+# Every individual, oldest first
+individualsQuery = 'SELECT * FROM INDIVIDUALS ORDER BY birth'
+
+# Get a list of all invdividuals as Individual records
 def getIndividuals(conn):
 
-	return conn.cursor().execute('SELECT * FROM INDIVIDUALS ORDER BY birth').fetchall()
+	return individualCursor(conn).execute(individualsQuery).fetchall()
+
+# Same as getIndividuals, yields each record as it is read
+def iterIndividuals(conn, batchSize=None):
+
+	return iterRows(individualCursor(conn).execute(individualsQuery), batchSize)
+
+# Up to limit Individual records by ID, starting after afterID (None: from the first one)
+# Each page is a seek on the ID index, so a page late in a large tree costs the same as the first
+def pageIndividuals(conn, afterID=None, limit=100):
+
+	if afterID is None:
+		return individualCursor(conn).execute(
+			'SELECT * FROM INDIVIDUALS ORDER BY id LIMIT ?',
+			(limit,)
+		).fetchall()
+
+	return individualCursor(conn).execute(
+		'SELECT * FROM INDIVIDUALS WHERE id > ? ORDER BY id LIMIT ?',
+		(afterID, limit)
+	).fetchall()
+
+
+
+# Get the set of every individual ID
+def getIndividualIDs(conn):
+
+	return set(row[0] for row in conn.cursor().execute('SELECT id FROM INDIVIDUALS'))
 
 
 
 # Get a certain individual by his ID
 def getIndividual(conn, indID):
 
-	return conn.cursor().execute(
+	return individualCursor(conn).execute(
 		'SELECT * FROM INDIVIDUALS WHERE id=?',
 		(indID,)
 	).fetchone()
 
 
 
-# Get a list of all families as tuples
+# Every family, by ID
+familiesQuery = 'SELECT * FROM FAMILIES ORDER BY id'
+
+# Get a list of all families as Family records (without their children)
 def getFamilies(conn):
 
-	return conn.cursor().execute('SELECT * FROM FAMILIES ORDER BY id').fetchall()
+	return familyCursor(conn).execute(familiesQuery).fetchall()
+
+# Same as getFamilies, yields each record as it is read
+def iterFamilies(conn, batchSize=None):
+
+	return iterRows(familyCursor(conn).execute(familiesQuery), batchSize)
+
+# Up to limit Family records by ID, starting after afterID (see pageIndividuals)
+def pageFamilies(conn, afterID=None, limit=100):
+
+	if afterID is None:
+		return familyCursor(conn).execute(
+			'SELECT * FROM FAMILIES ORDER BY id LIMIT ?',
+			(limit,)
+		).fetchall()
+
+	return familyCursor(conn).execute(
+		'SELECT * FROM FAMILIES WHERE id > ? ORDER BY id LIMIT ?',
+		(afterID, limit)
+	).fetchall()
+
+
+
+# Get the set of every family ID
+def getFamilyIDs(conn):
+
+	return set(row[0] for row in conn.cursor().execute('SELECT id FROM FAMILIES'))
 
 
 
 # Get a certain family by their ID
 def getFamily(conn, famID):
 
-	return conn.cursor().execute(
+	return familyCursor(conn).execute(
 		'SELECT * FROM FAMILIES WHERE id=?',
 		(famID,)
 	).fetchone()
 
 
-# Get all children in a given family as an array of IDs
-def getChildren(conn, famID):
-
-	return conn.cursor().execute('''
+# US28 - children of a family, oldest first
+childrenQuery = '''
 		SELECT children.childID
 		FROM children
 		INNER JOIN individuals
 		ON individuals.id == children.childID
 		WHERE famID=?
-		ORDER BY individuals.birth
-	''',
-		(famID,)
-	).fetchall()
+		ORDER BY individuals.birth, children.rowid
+	'''
+
+# Get all children in a given family as an array of IDs
+def getChildren(conn, famID):
+
+	return conn.cursor().execute(childrenQuery, (famID,)).fetchall()
+
+# Same as getChildren, yields each row as it is read
+def iterChildren(conn, famID, batchSize=None):
+
+	return iterQuery(conn, childrenQuery, (famID,), batchSize)
+
+# Every family with its husband's and wife's names and one row per child, oldest first
+# (a family without children has one row, with a NULL child)
+familyReportQuery = '''
+		SELECT
+			families.id, families.married, families.divorced,
+			families.husbID, husb.firstName, husb.lastName,
+			families.wifeID, wife.firstName, wife.lastName,
+			kids.childID
+		FROM
+			families
+			LEFT JOIN individuals AS husb
+			ON husb.id == families.husbID
+			LEFT JOIN individuals AS wife
+			ON wife.id == families.wifeID
+			LEFT JOIN (
+				SELECT children.rowid AS link, children.famID, children.childID, individuals.birth
+				FROM children
+				INNER JOIN individuals
+				ON individuals.id == children.childID
+			) AS kids
+			ON kids.famID == families.id
+		ORDER BY families.id, kids.birth, kids.link
+	'''
+
+# The family report, one query for every family instead of three per family
+# Yields [id, married, divorced, husbID, husband first name, husband last name,
+# wifeID, wife first name, wife last name, list of child IDs oldest first] as the rows are read
+def familyReportRows(conn, batchSize=None):
+
+	rows = iterQuery(conn, familyReportQuery, batchSize=batchSize)
+
+	for (family, familyRows) in itertools.groupby(rows, key=lambda row: row[:9]):
+		yield list(family) + [[row[9] for row in familyRows if row[9] is not None]]
+
+# Snapshots are binary copies of the individuals, families and children tables
+# Layout (little endian): magic, version (uint32), table count (uint32), then per table
+#   name (block), row count (uint32), column count (uint32), then per column
+#   name (block), type (1 byte), values
+# A block is a uint64 byte count followed by the bytes. Values of a 'd' (date) column are
+# int32 day numbers, 0 for NULL. Values of an 's' (text) column are an int32 length per row
+# (in characters, -1 for NULL) followed by one block of all the UTF-8 text.
+snapshotMagic = b'GEDSNAP\0'
+snapshotVersion = 1
+
+# The tables in a snapshot, with their columns and the type each is stored as
+snapshotTables = [
+	('individuals', [('id', 's'), ('firstName', 's'), ('lastName', 's'), ('gender', 's'), ('birth', 'd'), ('death', 'd')]),
+	('families', [('id', 's'), ('married', 'd'), ('divorced', 'd'), ('husbID', 's'), ('wifeID', 's')]),
+	('children', [('childID', 's'), ('famID', 's')])
+]
+
+# Write every individual, family and child link to a snapshot file
+# Returns the number of rows written from each table
+def exportSnapshot(conn, path):
+
+	counts = {}
+
+	with open(path, 'wb') as file:
+
+		file.write(snapshotMagic + struct.pack('<II', snapshotVersion, len(snapshotTables)))
+
+		for (table, columns) in snapshotTables:
+
+			rows = conn.cursor().execute(
+				'SELECT ' + ", ".join([name for (name, kind) in columns]) + ' FROM ' + table + ' ORDER BY rowid'
+			).fetchall()
+
+			writeBlock(file, table.encode('utf-8'))
+			file.write(struct.pack('<II', len(rows), len(columns)))
+
+			for (i, (name, kind)) in enumerate(columns):
+				writeBlock(file, name.encode('utf-8'))
+				writeColumn(file, kind, [row[i] for row in rows])
+
+			counts[table] = len(rows)
+
+	return counts
+
+# Load a snapshot written by exportSnapshot, in one transaction
+# Prints error and returns false if the file isn't a snapshot this version can read,
+# or its rows clash with rows already in the database
+def importSnapshot(conn, path):
+
+	tables = []
+
+	try:
+		with open(path, 'rb') as file:
+
+			magic = readExact(file, len(snapshotMagic))
+			(version, tableCount) = struct.unpack('<II', readExact(file, 8))
+
+			if magic != snapshotMagic:
+				raise ValueError("not a snapshot")
+			if version != snapshotVersion:
+				raise ValueError("unsupported snapshot version " + str(version))
+			if tableCount != len(snapshotTables):
+				raise ValueError("expected " + str(len(snapshotTables)) + " tables, found " + str(tableCount))
+
+			for (table, columns) in snapshotTables:
+
+				name = readBlock(file).decode('utf-8')
+				(rowCount, columnCount) = struct.unpack('<II', readExact(file, 8))
+
+				if name != table or columnCount != len(columns):
+					raise ValueError("expected table " + table + ", found " + name)
+
+				values = []
+				for (column, kind) in columns:
+
+					name = readBlock(file).decode('utf-8')
+					if name != column:
+						raise ValueError("expected column " + table + "." + column + ", found " + name)
+
+					values.append(readColumn(file, rowCount))
+
+				tables.append((table, list(zip(*values)) if rowCount > 0 else []))
+
+	except (ValueError, struct.error, UnicodeDecodeError) as err:
+		print("ERROR: SNAPSHOT: Can't load " + str(path) + ", " + str(err))
+		return False
+
+	curs = conn.cursor()
+
+	try:
+		for (table, rows) in tables:
+			if len(rows) > 0:
+				curs.executemany('INSERT INTO ' + table + ' VALUES (' + ", ".join(["?"] * len(rows[0])) + ')', rows)
+
+	except sqlite3.IntegrityError as err:
+		conn.rollback()
+		print("ERROR: SNAPSHOT: Can't load " + str(path) + ", " + str(err))
+		return False
+
+	# Let the next validation know what changed
+	(individuals, families, children) = [rows for (table, rows) in tables]
+
+	trackingInit(conn)
+	touchIndividuals(conn, [row[0] for row in individuals])
+	touchFamilies(conn, [row[0] for row in families])
+
+	conn.commit()
+
+	return True
+
+# Write one snapshot column, dates that aren't 'YYYY-MM-DD' text are kept as text
+def writeColumn(file, kind, values):
+
+	if kind == 'd':
+		try:
+			days = [0 if value is None else datetime.fromisoformat(value).toordinal() for value in values]
+
+		except (TypeError, ValueError):
+			kind = 's'
+
+	file.write(kind.encode('ascii'))
+
+	if kind == 'd':
+		file.write(struct.pack('<%di' % len(days), *days))
+		return
+
+	values = [None if value is None else str(value) for value in values]
+
+	file.write(struct.pack('<%di' % len(values), *[-1 if value is None else len(value) for value in values]))
+	writeBlock(file, "".join([value for value in values if value is not None]).encode('utf-8'))
+
+# Read one snapshot column of count values
+def readColumn(file, count):
+
+	kind = readExact(file, 1)
+
+	if kind == b'd':
+		days = struct.unpack('<%di' % count, readExact(file, 4 * count))
+		return [None if day == 0 else isoText(day) for day in days]
+
+	if kind != b's':
+		raise ValueError("unknown column type " + repr(kind))
+
+	lengths = struct.unpack('<%di' % count, readExact(file, 4 * count))
+	text = readBlock(file).decode('utf-8')
+
+	values = []
+	start = 0
+
+	for length in lengths:
+		if length < 0:
+			values.append(None)
+		else:
+			values.append(text[start:start + length])
+			start += length
+
+	return values
+
+def writeBlock(file, data):
+
+	file.write(struct.pack('<Q', len(data)))
+	file.write(data)
+
+def readBlock(file):
+
+	(size,) = struct.unpack('<Q', readExact(file, 8))
+
+	return readExact(file, size)
+
+# Read exactly size bytes, a short read means the snapshot was cut off
+def readExact(file, size):
+
+	data = file.read(size)
+
+	if len(data) != size:
+		raise ValueError("snapshot is truncated")
+
+	return data
 
 # Apply a given SQL query to the database that should return a list of results
-# Print out the given string for each row returned
+# Write a row to the sink (default: GEDCOM_Sinks.defaultSink) for each row returned
 # The string should be a valid format string with flags for each column of the SQL query
 # returns the raw rows
-def printQuery (conn, sql, msg):
+def printQuery (conn, sql, msg, rule=None, keys=(), kind="LIST", sink=None):
 
-	rows = conn.cursor().execute(sql).fetchall()
-	formatter = string.Formatter()
+	return printRows(conn.cursor().execute(sql).fetchall(), msg, rule, keys, kind, sink)
 
-	for row in rows:
-		print(formatter.vformat(msg, row, None))
+# Write the given format string for each row to the sink, returns the rows
+def printRows (rows, msg, rule=None, keys=(), kind="ANOMALY", sink=None):
+
+	(sink or sinks.defaultSink).write(anomalyRecords(rows, msg, rule, keys, kind))
 
 	return rows
 
-def validateDatabase(conn):
+# The rows of a rule as GEDCOM_Records.Anomaly, the first len(keys) columns are the IDs
+def anomalyRecords(rows, msg, rule, keys, kind):
 
-	noerrors = True
+	width = len(keys)
+
+	for row in rows:
+		yield Anomaly(rule, kind, tuple(row[:width]), msg, tuple(row))
+
+# Every validation rule as (rule ID, query, message, keys), the rule ID starts with the user story
+# Each query returns the IDs involved in an anomaly, the message is a format string for one row
+# keys says which table each returned ID belongs to
+# Rows are ordered by the rowids of their IDs in those tables (see anomalyOrder), so the stored
+# rows of an incremental validation come out in the same order as a full run
+validationRules = [
 
 	#US01 - dates before current date
 	# future births
-	noerrors &= len(printQuery(conn,
+	('US01-birth',
 		'''
 		SELECT individuals.id
 		FROM individuals
 		WHERE individuals.birth > DATE('now')
+		ORDER BY individuals.rowid
 		''',
 
-		"ANOMALY: US01: Dates Before Current Date: Individual {} was born after today."
-	)) == 0
+		"ANOMALY: US01: Dates Before Current Date: Individual {} was born after today.",
+		('individuals',)
+	),
 
 	# future deaths
-	noerrors &= len(printQuery(conn,
+	('US01-death',
 		'''
 		SELECT individuals.id
 		FROM individuals
 		WHERE individuals.death > DATE('now')
+		ORDER BY individuals.rowid
 		''',
 
-		"ANOMALY: US01: Dates Before Current Date: Individual {} died after today."
-	)) == 0
+		"ANOMALY: US01: Dates Before Current Date: Individual {} died after today.",
+		('individuals',)
+	),
 
 	# future marriages
-	noerrors &= len(printQuery(conn,
+	('US01-married',
 		'''
 		SELECT families.id
 		FROM families
 		WHERE families.married > DATE('now')
+		ORDER BY families.rowid
 		''',
 
-		"ANOMALY: US01 Dates Before Current Date: Family {} was married after today."
-	)) == 0
+		"ANOMALY: US01 Dates Before Current Date: Family {} was married after today.",
+		('families',)
+	),
 
 	#future divorces
-	noerrors &= len(printQuery(conn,
+	('US01-divorced',
 		'''
 		SELECT families.id
 		FROM families
 		WHERE families.divorced > DATE('now')
+		ORDER BY families.rowid
 		''',
 
-		"ANOMALY: US01: Dates Before Current Date: Family {} was divorced after today."
-	)) == 0
+		"ANOMALY: US01: Dates Before Current Date: Family {} was divorced after today.",
+		('families',)
+	),
 
 	#US02 - birth before marriage
-	noerrors &= len(printQuery(conn,
+	('US02',
 		'''
 		SELECT individuals.id
 		FROM
 			individuals INNER JOIN families
 			ON (individuals.id=families.husbID) OR (individuals.id=families.wifeID)
 		WHERE individuals.birth >= families.married
+		ORDER BY individuals.rowid
 		''',
 
-		"ANOMALY: US02: Birth Before Marriage: Individual {} was born on or before his/her wedding day."
-	)) == 0
+		"ANOMALY: US02: Birth Before Marriage: Individual {} was born on or before his/her wedding day.",
+		('individuals',)
+	),
 
 	#US03 - death before birth
-	noerrors &= len(printQuery(conn,
+	('US03',
 		'''
 		SELECT individuals.id
 		FROM individuals
 		WHERE (individuals.death NOT NULL) AND (individuals.birth > individuals.death)
+		ORDER BY individuals.rowid
 		''',
 
-		"ANOMALY: US03: Death before Birth: Individual {} is born after their death."
-	)) == 0
+		"ANOMALY: US03: Death before Birth: Individual {} is born after their death.",
+		('individuals',)
+	),
 
 	#US04 - marriage before divorce
-	noerrors &= len(printQuery(conn,
+	('US04',
 		'''
 		SELECT families.id
 		FROM families
 		WHERE (families.divorced NOT NULL) AND (families.divorced <= families.married)
+		ORDER BY families.rowid
 		''',
 
-		"ANOMALY: US04: Marriage Before Divorce: Family {} was divorced before their marriage"
-	)) == 0
+		"ANOMALY: US04: Marriage Before Divorce: Family {} was divorced before their marriage",
+		('families',)
+	),
 
 	#US05 - marriage before death
-	noerrors &= len(printQuery(conn,
+	('US05',
 		'''
 		SELECT individuals.id
 		FROM
 			individuals INNER JOIN families
 			ON (individuals.id=families.husbID) OR (individuals.id=families.wifeID)
 		WHERE families.married > individuals.death
+		ORDER BY individuals.rowid
 		''',
 
-		"ANOMALY: US05: Marriage Before Death: Individual {} was married after their death"
-	)) == 0
+		"ANOMALY: US05: Marriage Before Death: Individual {} was married after their death",
+		('individuals',)
+	),
 
 	#US16 - male last names
-	noerrors &= len(printQuery(conn,
+	('US16',
 		'''
 		SELECT i1.id
 		FROM
@@ -336,13 +1140,15 @@ def validateDatabase(conn):
 			INNER JOIN individuals AS i2
 			ON (f.husbID = i2.id)
 		WHERE i1.gender == "M" AND i2.lastName != i1.lastName
+		ORDER BY i1.rowid
 		''',
 
-		"ANOMALY: US16: Male Last Names: Individual {} does not have the same last name as their father."
-	)) == 0
+		"ANOMALY: US16: Male Last Names: Individual {} does not have the same last name as their father.",
+		('individuals',)
+	),
 
 	#US18 - siblings should not marry
-	noerrors &= len(printQuery(conn,
+	('US18',
 		'''
 		SELECT f.id
 		FROM
@@ -352,13 +1158,15 @@ def validateDatabase(conn):
 			INNER JOIN children as wifeFam
 			ON f.wifeID == wifeFam.childID
 		WHERE husbFam.famID == wifeFam.famID
+		ORDER BY f.rowid
 		''',
 
-		"ANOMALY: US18: Siblings should not marry: The spouses in family {} are siblings."
-	)) == 0
+		"ANOMALY: US18: Siblings should not marry: The spouses in family {} are siblings.",
+		('families',)
+	),
 
 	#US21 - correct gender for roll
-	noerrors &= len(printQuery(conn,
+	('US21',
 		'''
 		SELECT individuals.id
 		FROM
@@ -366,43 +1174,291 @@ def validateDatabase(conn):
 			ON
 				(individuals.id == families.husbID AND individuals.gender == "F") OR
 				(individuals.id == families.wifeID AND individuals.gender == "M")
+		ORDER BY individuals.rowid
 		''',
 
-		"ANOMALY: US21: Correct Gender For Role: Individual {} has the wrong gender for their family role."
-	)) == 0
+		"ANOMALY: US21: Correct Gender For Role: Individual {} has the wrong gender for their family role.",
+		('individuals',)
+	),
 
 	#US23 - Unique Name and Births
-	noerrors &= len(printQuery(conn,
+	# Groups by name and birthday first so only the people in a group are paired up
+	('US23',
 		'''
 		SELECT ind1.id, ind2.id
 		FROM
-			individuals as ind1 INNER JOIN
-			individuals as ind2 ON
-			ind1.id != ind2.id AND
-			ind1.birth == ind2.birth AND ind1.firstname==ind2.firstname AND ind1.lastname==ind2.lastname
+			(
+				SELECT firstName, lastName, birth
+				FROM individuals
+				WHERE firstName NOT NULL AND lastName NOT NULL AND birth NOT NULL
+				GROUP BY firstName, lastName, birth
+				HAVING COUNT(*) > 1
+			) AS dup
+			INNER JOIN individuals as ind1 ON
+			ind1.birth == dup.birth AND ind1.firstname==dup.firstname AND ind1.lastname==dup.lastname
+			INNER JOIN individuals as ind2 ON
+			ind2.birth == dup.birth AND ind2.firstname==dup.firstname AND ind2.lastname==dup.lastname AND
+			ind1.id != ind2.id
+		ORDER BY ind1.rowid, ind2.rowid
 		''',
 
-		"ANOMALY: US23: Unique Name and Birth: Individual {} has the same Name and Birthday as {}."
-	)) == 0
+		"ANOMALY: US23: Unique Name and Birth: Individual {} has the same Name and Birthday as {}.",
+		('individuals', 'individuals')
+	),
+
+]
+
+# Run every validation rule, writing each anomaly found to the sink
+# (default: GEDCOM_Sinks.defaultSink, which prints them). Returns false if there were any
+# With incremental, only rows involving records added since the last validation on this
+# connection (and their spouses, children and parents' families) are looked up again,
+# the rest come from what that validation found. The first run is always a full one.
+def validateDatabase(conn, incremental=False, sink=None):
+
+	noerrors = True
+
+	with stats.timer("validate"):
+
+		checkDatabase(conn, incremental)
+
+		for (rule, sql, msg, keys) in validationRules:
+			rows = printRows(getAnomalies(conn, rule, keys), msg, rule, keys, "ANOMALY", sink)
+			stats.count("anomalies." + rule, len(rows))
+			noerrors &= len(rows) == 0
 
 	return noerrors
 
+# Every anomaly as GEDCOM_Records.Anomaly, in the order validateDatabase writes them
+def iterAnomalies(conn, incremental=False):
 
-#US29 - List Deceased
-def printDeceased(conn):
-	return printQuery(conn,
+	with stats.timer("validate"):
+		checkDatabase(conn, incremental)
+
+	for (rule, sql, msg, keys) in validationRules:
+		yield from anomalyRecords(getAnomalies(conn, rule, keys), msg, rule, keys, "ANOMALY")
+
+# Bring the anomalies of every rule up to date (see validateDatabase)
+def checkDatabase(conn, incremental):
+
+	curs = conn.cursor()
+
+	trackingInit(conn)
+
+	if incremental and anomalyCacheReady(conn):
+		refreshAnomalies(conn)
+	else:
+		curs.execute('CREATE TEMP TABLE IF NOT EXISTS anomalies (rule TEXT, id1 TEXT, id2 TEXT)')
+		curs.execute('DELETE FROM temp.anomalies')
+
+		for (rule, sql, msg, keys) in validationRules:
+			with stats.timer("validate." + rule):
+				storeAnomalies(conn, rule, sql, keys)
+
+	# Everything is up to date now
+	curs.execute('DELETE FROM temp.touchedIndividuals')
+	curs.execute('DELETE FROM temp.touchedFamilies')
+	conn.commit()
+
+# Same as a full validateDatabase, with the rules run at the same time on the pool's connections
+# Anomalies are written rule by rule in the order of validationRules, like validateDatabase.
+# Doesn't use or update the stored anomalies incremental validation works from.
+def validatePooled(pool, sink=None):
+
+	def runRule(conn, rule):
+		with stats.timer("validate." + rule[0]):
+			return conn.cursor().execute(rule[1]).fetchall()
+
+	noerrors = True
+
+	with stats.timer("validate"):
+
+		found = pool.map(runRule, validationRules)
+
+		for ((rule, sql, msg, keys), rows) in zip(validationRules, found):
+			printRows(rows, msg, rule, keys, "ANOMALY", sink)
+			stats.count("anomalies." + rule, len(rows))
+			noerrors &= len(rows) == 0
+
+	return noerrors
+
+# Validate only what changed since the last validation (see validateDatabase)
+def validateChanges(conn, sink=None):
+	return validateDatabase(conn, incremental=True, sink=sink)
+
+# Has a validation already filled in the anomalies for this connection
+def anomalyCacheReady(conn):
+
+	return conn.cursor().execute(
+		"SELECT 1 FROM sqlite_temp_master WHERE type == 'table' AND name == 'anomalies'"
+	).fetchone() is not None
+
+# The statement storeAnomalies runs for a rule, its one parameter is the rule ID
+def storeQuery(sql, keys, filter="1"):
+
+	columns = ", ".join(["id" + str(i + 1) for i in range(len(keys))])
+	values = "id1, id2" if len(keys) == 2 else "id1, NULL"
+
+	return ("WITH rows(" + columns + ") AS (" + sql + ") " +
+		"INSERT INTO temp.anomalies SELECT ?, " + values + " FROM rows WHERE " + filter)
+
+# Run a rule and keep its rows, filter is an extra condition on the row IDs (id1, id2)
+def storeAnomalies(conn, rule, sql, keys, filter="1"):
+
+	conn.cursor().execute(storeQuery(sql, keys, filter), (rule,))
+
+# ORDER BY terms for stored rows that give the order of the rules' own queries:
+# the rowid of each ID in its table
+def anomalyOrder(keys):
+
+	return ", ".join([
+		"(SELECT rowid FROM " + key + " WHERE id == id" + str(i + 1) + ")"
+		for (i, key) in enumerate(keys)
+	])
+
+# Get the stored rows of a rule, in the shape and order the rule's query returns them
+def getAnomalies(conn, rule, keys):
+
+	columns = "id1, id2" if len(keys) == 2 else "id1"
+
+	return conn.cursor().execute(
+		"SELECT " + columns + " FROM temp.anomalies WHERE rule == ? ORDER BY " + anomalyOrder(keys),
+		(rule,)
+	).fetchall()
+
+# Every individual a new anomaly could be reported against, given the touched records
+# (the spouse and child lookups go through familiesHusb, familiesWife and childrenFam)
+affectedIndividualsQuery = '''
+		INSERT OR IGNORE INTO temp.affectedIndividuals
+		SELECT id FROM temp.touchedIndividuals
+		UNION
+		SELECT husbID FROM families WHERE id IN temp.touchedFamilies
+		UNION
+		SELECT wifeID FROM families WHERE id IN temp.touchedFamilies
+		UNION
+		SELECT childID FROM children WHERE famID IN temp.touchedFamilies
+		UNION
+		SELECT children.childID
+		FROM
+			children INNER JOIN families
+			ON children.famID == families.id
+		WHERE families.husbID IN temp.touchedIndividuals
+	'''
+
+# Every family a new anomaly could be reported against
+affectedFamiliesQuery = '''
+		INSERT OR IGNORE INTO temp.affectedFamilies
+		SELECT id FROM temp.touchedFamilies
+		UNION
+		SELECT id FROM families WHERE husbID IN temp.touchedIndividuals
+		UNION
+		SELECT id FROM families WHERE wifeID IN temp.touchedIndividuals
+	'''
+
+# Queries that only look at the affected records, for rules whose full query can't be narrowed
+# down by filtering its rows. Each returns every row of the full query that involves an affected
+# record (and maybe others, the affected filter still applies).
+affectedRules = {
+
+	#US23 - only the groups of the affected people's names and birthdays
+	'US23':
+		'''
+		SELECT ind1.id, ind2.id
+		FROM
+			(
+				SELECT individuals.firstName, individuals.lastName, individuals.birth
+				FROM
+					(
+						SELECT DISTINCT firstName, lastName, birth
+						FROM individuals
+						WHERE id IN temp.affectedIndividuals AND
+							firstName NOT NULL AND lastName NOT NULL AND birth NOT NULL
+					) AS changed
+					INNER JOIN individuals ON
+					individuals.birth == changed.birth AND individuals.firstName == changed.firstName AND
+					individuals.lastName == changed.lastName
+				GROUP BY individuals.firstName, individuals.lastName, individuals.birth
+				HAVING COUNT(*) > 1
+			) AS dup
+			INNER JOIN individuals as ind1 ON
+			ind1.birth == dup.birth AND ind1.firstname==dup.firstname AND ind1.lastname==dup.lastname
+			INNER JOIN individuals as ind2 ON
+			ind2.birth == dup.birth AND ind2.firstname==dup.firstname AND ind2.lastname==dup.lastname AND
+			ind1.id != ind2.id
+		'''
+}
+
+# Condition on a rule's row IDs that keeps the rows of affected records
+# Pushed down into the rule, it makes SQLite start from those records instead of scanning
+# (the spouse rules then find the families through familiesHusb and familiesWife)
+def affectedFilter(keys):
+
+	return " OR ".join([
+		"id" + str(i + 1) + " IN temp.affected" + key[0].upper() + key[1:]
+		for (i, key) in enumerate(keys)
+	])
+
+# Re-run the rules for the records added since the last validation
+def refreshAnomalies(conn):
+
+	curs = conn.cursor()
+
+	if (curs.execute('SELECT 1 FROM temp.touchedIndividuals').fetchone() is None and
+		curs.execute('SELECT 1 FROM temp.touchedFamilies').fetchone() is None):
+		return
+
+	# Every record a new anomaly could be reported against
+	curs.execute('CREATE TEMP TABLE IF NOT EXISTS affectedIndividuals (id TEXT PRIMARY KEY)')
+	curs.execute('CREATE TEMP TABLE IF NOT EXISTS affectedFamilies (id TEXT PRIMARY KEY)')
+	curs.execute('DELETE FROM temp.affectedIndividuals')
+	curs.execute('DELETE FROM temp.affectedFamilies')
+
+	curs.execute(affectedIndividualsQuery)
+	curs.execute(affectedFamiliesQuery)
+
+	for (rule, sql, msg, keys) in validationRules:
+
+		affected = affectedFilter(keys)
+		sql = affectedRules.get(rule, sql)
+
+		with stats.timer("validate." + rule):
+			curs.execute("DELETE FROM temp.anomalies WHERE rule == ? AND (" + affected + ")", (rule,))
+			storeAnomalies(conn, rule, sql, keys, affected)
+
+# Temp tables (only seen by this connection) listing the records added since the last validation
+def trackingInit(conn):
+
+	curs = conn.cursor()
+
+	curs.execute('CREATE TEMP TABLE IF NOT EXISTS touchedIndividuals (id TEXT PRIMARY KEY)')
+	curs.execute('CREATE TEMP TABLE IF NOT EXISTS touchedFamilies (id TEXT PRIMARY KEY)')
+
+# Remember that these records were added or linked since the last validation
+def touchIndividuals(conn, ids):
+
+	conn.cursor().executemany('INSERT OR IGNORE INTO temp.touchedIndividuals VALUES (?)', [(i,) for i in ids])
+
+def touchFamilies(conn, ids):
+
+	conn.cursor().executemany('INSERT OR IGNORE INTO temp.touchedFamilies VALUES (?)', [(i,) for i in ids])
+
+
+# Every list as (rule ID, query, message, keys), in the same shape as validationRules
+listRules = [
+
+	#US29 - List Deceased
+	('US29',
 		'''
 		SELECT individuals.id
 		FROM individuals
 		WHERE individuals.death NOT NULL AND individuals.death < DATE('now')
 		''',
 
-		"LIST: US29: List Deceased: Individual {} is no longer alive."
-	)
+		"LIST: US29: List Deceased: Individual {} is no longer alive.",
+		('individuals',)
+	),
 
-#US30 - List living Married
-def printLivingMarried(conn):
-	return printQuery(conn,
+	#US30 - List living Married
+	('US30',
 		'''
 		SELECT husband.id
 		FROM
@@ -419,59 +1475,64 @@ def printLivingMarried(conn):
 			INNER JOIN individuals as husband
 			ON (husband.id=families.husbID)
 		WHERE families.divorced IS NULL AND husband.death IS NULL AND wife.death IS NULL
-
 		''',
 
-		"LIST: US30: List Living Married: Individual {} is married and alive."
-	)
+		"LIST: US30: List Living Married: Individual {} is married and alive.",
+		('individuals',)
+	),
 
-#US32 - Multiple Births
-def printMultipleBirths(conn):
-	return printQuery(conn,
+	#US32 - Multiple Births
+	# Groups children by family and birthday first, then lists the members of every group
+	# with more than one child (CROSS JOIN keeps SQLite walking family -> child, not birthday -> everyone)
+	('US32',
 		'''
-		SELECT DISTINCT child1.id, child1Link.famID, child1.birth
+		SELECT child1.id, child1Link.famID, child1.birth
 		FROM
-			individuals as child1
-			INNER JOIN individuals as child2
-			ON child1.id != child2.id
-			INNER JOIN children as child1Link ON
-			child1.id == child1Link.childID
-			INNER JOIN children as child2Link ON
-			child2.id == child2Link.childID
-		WHERE child1Link.famID == child2Link.famID AND child1.birth == child2.birth
-		ORDER BY child1.birth, child1Link.famID
+			(
+				SELECT children.famID, individuals.birth
+				FROM
+					children INNER JOIN individuals
+					ON individuals.id == children.childID
+				WHERE individuals.birth NOT NULL
+				GROUP BY children.famID, individuals.birth
+				HAVING COUNT(*) > 1
+			) AS births
+			CROSS JOIN children as child1Link ON
+			child1Link.famID == births.famID
+			CROSS JOIN individuals as child1 ON
+			child1.id == child1Link.childID AND child1.birth == births.birth
+		ORDER BY child1.birth, child1Link.famID, child1.id
 		''',
 
-		"LIST: US32: List Multiple Births: Individual {} was part of a multiple birth in family {} on {}."
-	)
+		"LIST: US32: List Multiple Births: Individual {} was part of a multiple birth in family {} on {}.",
+		('individuals', 'families')
+	),
 
-#US33 - List Orphans
-def printOrphans(conn):
-	return printQuery(conn,
-	'''
-	SELECT child.id
-	FROM
-		individuals as child
-		INNER JOIN children
-		ON child.id == children.childID
-		INNER JOIN FAMILIES
-		ON families.id == children.famID
-		INNER JOIN individuals as father
-		ON families.husbID == father.id
-		INNER JOIN individuals as mother
-		ON families.wifeID == mother.id
-	WHERE julianday('now') - julianday(child.birth) < 18*365.25 AND
-		mother.death IS NOT NULL and father.death IS NOT NULL
-
-	''',
-
-	"LIST: US33: List Orphans: Individual {} was orphaned."
-	)
+	#US33 - List Orphans
+	('US33',
+		'''
+		SELECT child.id
+		FROM
+			individuals as child
+			INNER JOIN children
+			ON child.id == children.childID
+			INNER JOIN FAMILIES
+			ON families.id == children.famID
+			INNER JOIN individuals as father
+			ON families.husbID == father.id
+			INNER JOIN individuals as mother
+			ON families.wifeID == mother.id
+		WHERE julianday('now') - julianday(child.birth) < 18*365.25 AND
+			mother.death IS NOT NULL and father.death IS NOT NULL
+		''',
 
-#US34 - print large age differences
-def printLargeAgeDifferences(conn):
-	return printQuery(conn,
-	'''
+		"LIST: US33: List Orphans: Individual {} was orphaned.",
+		('individuals',)
+	),
+
+	#US34 - print large age differences
+	('US34',
+		'''
 		SELECT husband.id, wife.id
 
 		FROM families
@@ -490,7 +1551,57 @@ def printLargeAgeDifferences(conn):
 				((julianday(families.married) - julianday(wife.birth)) * 2) >=
 				(julianday(families.married) - julianday(husband.birth))
 			)
-	''',
+		''',
 
-	"LIST: US34: List Large Age Differences: Individual {} and {} were married with a large age difference"
-	)
+		"LIST: US34: List Large Age Differences: Individual {} and {} were married with a large age difference",
+		('individuals', 'individuals')
+	),
+
+]
+
+# Run one list, writing its rows to the sink (default: GEDCOM_Sinks.defaultSink)
+# Returns the raw rows
+def printList(conn, rule, sink=None):
+
+	for (listRule, sql, msg, keys) in listRules:
+		if listRule == rule:
+			return printQuery(conn, sql, msg, rule, keys, "LIST", sink)
+
+	raise KeyError(rule)
+
+# Every list, with the queries run at the same time on the pool's connections
+# Rows are written list by list in the order of listRules, returns the raw rows of each list
+def printListsPooled(pool, sink=None):
+
+	found = queryAll(pool, [sql for (rule, sql, msg, keys) in listRules])
+
+	for ((rule, sql, msg, keys), rows) in zip(listRules, found):
+		printRows(rows, msg, rule, keys, "LIST", sink)
+
+	return found
+
+# Every list row as GEDCOM_Records.Anomaly, list by list in the order of listRules
+def iterLists(conn, batchSize=None):
+
+	for (rule, sql, msg, keys) in listRules:
+		yield from anomalyRecords(iterQuery(conn, sql, batchSize=batchSize), msg, rule, keys, "LIST")
+
+#US29 - List Deceased
+def printDeceased(conn, sink=None):
+	return printList(conn, 'US29', sink)
+
+#US30 - List living Married
+def printLivingMarried(conn, sink=None):
+	return printList(conn, 'US30', sink)
+
+#US32 - Multiple Births
+def printMultipleBirths(conn, sink=None):
+	return printList(conn, 'US32', sink)
+
+#US33 - List Orphans
+def printOrphans(conn, sink=None):
+	return printList(conn, 'US33', sink)
+
+#US34 - print large age differences
+def printLargeAgeDifferences(conn, sink=None):
+	return printList(conn, 'US34', sink)
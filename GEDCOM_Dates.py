@@ -0,0 +1,117 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|GEDCOM date values                                                                  |#
+#|parseDate turns the text of a DATE line into a GedcomDate, a day number that        |#
+#|compares like an int and is stored in the database as 'YYYY-MM-DD' text.           |#
+#|Results are cached, trees repeat the same few thousand dates over and over.         |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import sqlite3
+import datetime
+import functools
+
+#dictionary of months with numeric values as the keys
+monthnums = {
+	'JAN':1,
+	'FEB':2,
+	'MAR':3,
+	'APR':4,
+	'MAY':5,
+	'JUN':6,
+	'JUL':7,
+	'AUG':8,
+	'SEP':9,
+	'OCT':10,
+	'NOV':11,
+	'DEC':12
+}
+
+# Words that qualify a date without changing which day it is stored as
+# ABT 1900 (approximated), BEF/AFT/BET 1900 (range), FROM/TO 1900 (period), INT 1900 (interpreted)
+qualifiers = {'ABT', 'CAL', 'EST', 'BEF', 'AFT', 'BET', 'FROM', 'TO', 'INT'}
+
+# How many distinct date strings parseDate remembers
+dateCacheSize = 8192
+
+# A date as its day number (datetime.date.toordinal), so dates compare and sort as plain ints
+# sqlite3 stores it as ISO text, the same as a datetime.date
+class GedcomDate(int):
+
+	__slots__ = ()
+
+	def isoformat(self):
+		return isoText(self)
+
+	def date(self):
+		return datetime.date.fromordinal(self)
+
+	# Called by sqlite3 when the date is bound to a query
+	def __conform__(self, protocol):
+		if protocol is sqlite3.PrepareProtocol:
+			return isoText(self)
+
+	def __str__(self):
+		return isoText(self)
+
+	def __repr__(self):
+		return "GedcomDate('" + isoText(self) + "')"
+
+@functools.lru_cache(maxsize=dateCacheSize)
+def isoText(dayNumber):
+	return datetime.date.fromordinal(dayNumber).isoformat()
+
+# Parse one [day] [month] year date from a list of words
+# Missing parts are taken as the first day of the month or year
+# Returns None if the words aren't a date
+def parseDateWords(words):
+
+	if len(words) == 0 or len(words) > 3:
+		return None
+
+	# dual years (1699/00) are stored as the first year
+	# (isdecimal, not isdigit: int() rejects digits like "²")
+	year = words[-1].split('/')[0]
+	if not year.isdecimal():
+		return None
+
+	month = 1
+	day = 1
+
+	if len(words) >= 2:
+		month = monthnums.get(words[-2].upper())
+		if month is None:
+			return None
+
+	if len(words) == 3:
+		if not words[0].isdecimal():
+			return None
+		day = int(words[0])
+
+	year = int(year)
+	if year < datetime.MINYEAR or year > datetime.MAXYEAR or day < 1 or day > 31:
+		return None
+
+	try:
+		return GedcomDate(datetime.date(year, month, day).toordinal())
+	except ValueError:
+		# 31 FEB and the like
+		return None
+
+# Turn the value of a DATE line into a GedcomDate
+# Handles exact (25 APR 1950), partial (APR 1950, 1950), approximated (ABT, CAL, EST),
+# range (BEF, AFT, BET ... AND ...) and period (FROM ... TO ...) dates. Ranges and periods
+# are stored as their first date. Returns None, never raises, if the text isn't a date.
+@functools.lru_cache(maxsize=dateCacheSize)
+def parseDate(text):
+
+	words = text.split()
+
+	# drop the qualifier, keep the first date of a range or period
+	if len(words) > 0 and words[0].upper() in qualifiers:
+		words = words[1:]
+
+	for (i, word) in enumerate(words):
+		if word.upper() in ('AND', 'TO') or word.startswith('('):
+			words = words[:i]
+			break
+
+	return parseDateWords(words)
@@ -0,0 +1,431 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|Synthetic GEDCOM trees                                                              |#
+#|Family lines grow from founder couples, generation by generation, until the tree    |#
+#|has the requested number of individuals. The same seed always gives the same file.  |#
+#|python GEDCOM_Generator.py -n 10000 --seed 1 --anomaly US02=0.01 -o tree.ged         |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import sys
+import random
+import argparse
+import datetime
+import collections
+
+from GEDCOM_Dates import monthnums
+
+# Nobody is born, married, divorced or dies after this year, so a tree without
+# injected anomalies stays valid whatever day it is read on
+lastYear = 2020
+
+# First year of the founder couples
+firstYear = 1600
+
+# US01 births are this year or up to 50 years later, fixed so a seed always gives the
+# same file and far enough ahead to stay after today
+futureYear = lastYear + 1000
+
+# How many children a family has, one is picked at random for each family
+childCounts = [0, 1, 1, 2, 2, 2, 3, 3, 4, 5, 6]
+
+# Deep trees: few children per family, so the tree grows down more generations before it
+# reaches its size instead of spreading out, starting in the year 100
+deepChildCounts = [1, 1, 2]
+deepFirstYear = 100
+
+maleNames = ["James", "John", "Robert", "Michael", "William", "David", "Richard", "Joseph",
+	"Thomas", "Charles", "Daniel", "Matthew", "Anthony", "Mark", "Paul", "Steven", "Andrew",
+	"Kenneth", "Joshua", "Kevin", "Brian", "George", "Edward", "Ronald", "Timothy", "Jason",
+	"Jeffrey", "Ryan", "Jacob", "Gary", "Nicholas", "Eric", "Jonathan", "Stephen", "Larry",
+	"Justin", "Scott", "Brandon", "Benjamin", "Samuel", "Gregory", "Frank", "Alexander",
+	"Raymond", "Patrick", "Jack", "Dennis", "Jerry", "Tyler", "Aaron", "Henry", "Walter"]
+
+femaleNames = ["Mary", "Patricia", "Jennifer", "Linda", "Elizabeth", "Barbara", "Susan",
+	"Jessica", "Sarah", "Karen", "Nancy", "Lisa", "Betty", "Margaret", "Sandra", "Ashley",
+	"Kimberly", "Emily", "Donna", "Michelle", "Dorothy", "Carol", "Amanda", "Melissa",
+	"Deborah", "Stephanie", "Rebecca", "Sharon", "Laura", "Cynthia", "Kathleen", "Amy",
+	"Shirley", "Angela", "Helen", "Anna", "Brenda", "Pamela", "Nicole", "Emma", "Samantha",
+	"Katherine", "Christine", "Debra", "Rachel", "Catherine", "Carolyn", "Janet", "Ruth",
+	"Maria", "Heather", "Diane"]
+
+lastNames = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+	"Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas",
+	"Taylor", "Moore", "Jackson", "Martin", "Lee", "Perez", "Thompson", "White", "Harris",
+	"Sanchez", "Clark", "Ramirez", "Lewis", "Robinson", "Walker", "Young", "Allen", "King",
+	"Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores", "Green", "Adams", "Nelson",
+	"Baker", "Hall", "Rivera", "Campbell", "Mitchell", "Carter", "Roberts", "Gomez",
+	"Phillips", "Evans", "Turner", "Diaz", "Parker", "Cruz", "Edwards", "Collins", "Reyes",
+	"Stewart", "Morris", "Morales", "Murphy", "Cook", "Rogers", "Gutierrez", "Ortiz",
+	"Morgan", "Cooper", "Peterson", "Bailey", "Reed", "Kelly", "Howard", "Ramos", "Kim",
+	"Cox", "Ward", "Richardson", "Watson", "Brooks", "Chavez", "Wood", "James", "Bennett",
+	"Gray", "Mendoza", "Ruiz", "Hughes", "Price", "Alvarez", "Castillo", "Sanders", "Patel",
+	"Myers", "Long", "Ross", "Foster", "Jimenez"]
+
+# The user stories anomalies can be injected for, and what each one does
+anomalyStories = {
+	"US01": "an individual is born after today",
+	"US02": "a wife is born after her wedding",
+	"US03": "an individual dies before being born",
+	"US04": "a couple divorces before marrying",
+	"US05": "a husband dies before his wedding",
+	"US16": "a son has a different last name than his father",
+	"US18": "a brother and sister marry",
+	"US19": "a woman marries her first cousin",
+	"US21": "a husband is a woman",
+	"US22": "an individual's ID is used again",
+	"US23": "an individual is listed twice, under two IDs"
+}
+
+monthNames = {number: name for (name, number) in monthnums.items()}
+
+# GEDCOM text of a date
+def dateText(date):
+	return str(date.day) + " " + monthNames[date.month] + " " + str(date.year)
+
+# Generates one tree, lines() yields it line by line
+# anomalies maps a user story in anomalyStories to the chance (0 to 1) that each record
+# it could apply to gets that anomaly
+# deep uses deepChildCounts and deepFirstYear instead of childCounts and firstYear
+class TreeGenerator:
+
+	def __init__(self, count, seed=0, anomalies=None, deep=False):
+
+		for story in (anomalies or {}):
+			if story not in anomalyStories:
+				raise ValueError("no anomaly for " + story + ", choose from " + ", ".join(sorted(anomalyStories)))
+
+		self.count = count
+		self.random = random.Random(seed)
+		self.anomalies = anomalies or {}
+		self.childCounts = deepChildCounts if deep else childCounts
+		self.firstYear = deepFirstYear if deep else firstYear
+
+		self.individuals = 0
+		self.families = 0
+
+		# family ID -> grandsons through that family still unmarried, for US19
+		# (a grandson is listed under both of his parents' families)
+		self.bachelors = collections.defaultdict(list)
+
+		# IDs of the grandsons cousinFor already found a wife for
+		self.takenCousins = set()
+
+	# Should an anomaly for this story be injected here
+	def inject(self, story):
+
+		rate = self.anomalies.get(story, 0)
+
+		return rate > 0 and self.random.random() < rate
+
+	def randomDate(self, year):
+		return datetime.date(year, 1, 1) + datetime.timedelta(days=self.random.randrange(365))
+
+	def newIndividualID(self):
+
+		self.individuals += 1
+
+		return "I" + str(self.individuals)
+
+	def newFamilyID(self):
+
+		self.families += 1
+
+		return "F" + str(self.families)
+
+	# A new person born in the given year, as a dictionary of their fields
+	def newPerson(self, gender, lastName, year):
+
+		birth = self.randomDate(year)
+
+		person = {
+			"id": self.newIndividualID(),
+			"firstName": self.random.choice(maleNames if gender == "M" else femaleNames),
+			"lastName": lastName,
+			"gender": gender,
+			"birth": birth,
+			"death": None,
+			"famc": None,
+			"fams": None
+		}
+
+		# most of the people born long enough ago are dead
+		age = self.random.randint(40, 95)
+		if birth.year + age < lastYear and self.random.random() < 0.8:
+			person["death"] = self.randomDate(birth.year + age)
+
+		if self.inject("US01"):
+			person["birth"] = self.randomDate(futureYear + self.random.randint(0, 50))
+			person["death"] = None
+
+		if self.inject("US03") and person["death"] is None:
+			person["death"] = person["birth"] - datetime.timedelta(days=self.random.randint(1, 3650))
+
+		return person
+
+	# GEDCOM lines of an individual
+	def individualLines(self, person):
+
+		lines = [
+			"0 " + person["id"] + " INDI",
+			"1 NAME " + person["firstName"] + " /" + person["lastName"] + "/",
+			"1 SEX " + person["gender"],
+			"1 BIRT",
+			"2 DATE " + dateText(person["birth"])
+		]
+
+		if person["death"] is not None:
+			lines += ["1 DEAT", "2 DATE " + dateText(person["death"])]
+
+		if person["famc"] is not None:
+			lines.append("1 FAMC " + person["famc"])
+
+		if person["fams"] is not None:
+			lines.append("1 FAMS " + person["fams"])
+
+		return lines
+
+	# A new family for husband and wife, marrying once both are grown up
+	# Returns None if they would have to marry after lastYear
+	def newFamily(self, husband, wife):
+
+		year = max(husband["birth"].year, wife["birth"].year) + self.random.randint(18, 35)
+		if year > lastYear or year < datetime.MINYEAR:
+			return None
+
+		# a couple only marries while both are alive (unless one of them already has a US03 anomaly)
+		for spouse in (husband, wife):
+			if spouse["death"] is not None and spouse["birth"] < spouse["death"] and spouse["death"].year <= year:
+				deathYear = year + self.random.randint(1, 40)
+				spouse["death"] = self.randomDate(deathYear) if deathYear < lastYear else None
+
+		family = {
+			"id": self.newFamilyID(),
+			"married": self.randomDate(year),
+			"divorced": None,
+			"husband": husband,
+			"wife": wife,
+			"children": []
+		}
+
+		husband["fams"] = family["id"]
+		wife["fams"] = family["id"]
+
+		if year + 1 < lastYear and self.random.random() < 0.1:
+			family["divorced"] = self.randomDate(self.random.randint(year + 1, lastYear - 1))
+
+		if self.inject("US02"):
+			wife["birth"] = family["married"] + datetime.timedelta(days=self.random.randint(1, 3650))
+			wife["death"] = None
+
+		if self.inject("US04"):
+			family["divorced"] = family["married"] - datetime.timedelta(days=self.random.randint(1, 3650))
+
+		if self.inject("US05"):
+			husband["death"] = family["married"] - datetime.timedelta(days=self.random.randint(1, 3650))
+
+		if self.inject("US21"):
+			husband["gender"] = "F"
+
+		return family
+
+	# GEDCOM lines of a family
+	def familyLines(self, family):
+
+		lines = [
+			"0 " + family["id"] + " FAM",
+			"1 HUSB " + family["husband"]["id"],
+			"1 WIFE " + family["wife"]["id"],
+			"1 MARR",
+			"2 DATE " + dateText(family["married"])
+		]
+
+		if family["divorced"] is not None:
+			lines += ["1 DIV", "2 DATE " + dateText(family["divorced"])]
+
+		lines += ["1 CHIL " + child["id"] for child in family["children"]]
+
+		return lines
+
+	# An unmarried first cousin for a woman born into family (not one of her brothers)
+	# He has to live past the latest year newFamily could pick for the wedding, dying before
+	# it would add a US05 anomaly. Returns None if there isn't one.
+	def cousinFor(self, family, woman):
+
+		for parent in (family["husband"], family["wife"]):
+
+			cousins = self.bachelors.get(parent["famc"], [])
+
+			# the ones taken through the other family he is listed under
+			cousins[:] = [cousin for cousin in cousins if cousin["id"] not in self.takenCousins]
+
+			for cousin in cousins:
+
+				year = max(woman["birth"].year, cousin["birth"].year) + 35
+
+				if cousin["famc"] != family["id"] and (cousin["death"] is None or cousin["death"].year > year):
+					cousins.remove(cousin)
+					self.takenCousins.add(cousin["id"])
+					return cousin
+
+		return None
+
+	# A spouse from outside the tree for someone
+	def outsider(self, person):
+
+		gender = "F" if person["gender"] == "M" else "M"
+		year = person["birth"].year + self.random.randint(-5, 5)
+
+		return self.newPerson(gender, self.random.choice(lastNames), year)
+
+	# Yields the lines of the tree
+	def lines(self):
+
+		yield "0 HEAD"
+		yield "1 SOUR GEDCOM_Generator"
+		yield "1 GEDC"
+		yield "2 VERS 5.5.1"
+		yield "1 CHAR UTF-8"
+
+		# families whose children are still to be born, oldest first
+		pending = collections.deque()
+
+		# the last individual written, for US22 and US23
+		last = None
+
+		while self.individuals < self.count:
+
+			# start a new line of the tree whenever the others have died out
+			if len(pending) == 0:
+
+				year = self.random.randint(self.firstYear, self.firstYear + 100)
+				husband = self.newPerson("M", self.random.choice(lastNames), year)
+				wife = self.newPerson("F", self.random.choice(lastNames), year + self.random.randint(-5, 5))
+				family = self.newFamily(husband, wife)
+
+				for person in (husband, wife):
+					yield from self.individualLines(person)
+
+				if family is not None:
+					pending.append(family)
+
+				last = wife
+				continue
+
+			family = pending.popleft()
+			husband = family["husband"]
+			sons = []
+			daughters = []
+
+			for i in range(self.random.choice(self.childCounts)):
+
+				year = family["married"].year + self.random.randint(1, 20)
+				if year >= lastYear or self.individuals >= self.count:
+					break
+
+				gender = self.random.choice("MF")
+				lastName = husband["lastName"]
+				if gender == "M" and self.inject("US16"):
+					lastName = self.random.choice([name for name in lastNames if name != lastName])
+
+				child = self.newPerson(gender, lastName, year)
+				child["famc"] = family["id"]
+				family["children"].append(child)
+
+				(sons if gender == "M" else daughters).append(child)
+
+			# a brother and sister marry each other instead of outsiders
+			couples = []
+			if sons and daughters and self.inject("US18"):
+				couples.append((sons.pop(), daughters.pop()))
+
+			for child in sons + daughters:
+
+				# the cousin was already written, without the family they marry into
+				if child["gender"] == "F" and self.inject("US19"):
+					cousin = self.cousinFor(family, child)
+					if cousin is not None:
+						couples.append((cousin, child))
+						continue
+
+				if self.random.random() < 0.8:
+					spouse = self.outsider(child)
+					couples.append((child, spouse) if child["gender"] == "M" else (spouse, child))
+
+				elif child["gender"] == "M":
+					for parent in (family["husband"], family["wife"]):
+						if parent["famc"] is not None:
+							self.bachelors[parent["famc"]].append(child)
+
+			for (husb, wife) in couples:
+
+				childFamily = self.newFamily(husb, wife)
+				if childFamily is not None:
+					pending.append(childFamily)
+
+				for person in (husb, wife):
+					if person["famc"] is None:
+						yield from self.individualLines(person)
+
+			for child in family["children"]:
+				yield from self.individualLines(child)
+				last = child
+
+			yield from self.familyLines(family)
+
+			if last is not None and self.inject("US22"):
+				copy = dict(last, firstName=self.random.choice(maleNames + femaleNames))
+				yield from self.individualLines(copy)
+
+			if last is not None and self.inject("US23"):
+				copy = dict(last, id=self.newIndividualID(), famc=None, fams=None)
+				yield from self.individualLines(copy)
+
+		# families still waiting for children are written without them
+		for family in pending:
+			yield from self.familyLines(family)
+
+		yield "0 TRLR"
+
+# Yields the lines of a tree of about count individuals (see TreeGenerator)
+def generateLines(count, seed=0, anomalies=None, deep=False):
+
+	return TreeGenerator(count, seed, anomalies, deep).lines()
+
+# Write a tree to a file, returns the number of lines written
+def writeTree(filePath, count, seed=0, anomalies=None, deep=False):
+
+	written = 0
+
+	with open(filePath, "w") as file:
+		for line in generateLines(count, seed, anomalies, deep):
+			file.write(line + "\n")
+			written += 1
+
+	return written
+
+# "US02=0.01" -> ("US02", 0.01)
+def anomalyArgument(text):
+
+	(story, rate) = text.split("=")
+
+	return (story.upper(), float(rate))
+
+if __name__ == "__main__":
+
+	argParser = argparse.ArgumentParser(description="Generate a synthetic GEDCOM tree")
+	argParser.add_argument("-n", "--individuals", type=int, default=1000,
+		help="about how many individuals the tree has (default: 1000)")
+	argParser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+	argParser.add_argument("--anomaly", type=anomalyArgument, action="append", default=[],
+		metavar="STORY=RATE",
+		help="inject anomalies for a user story into that fraction of the records it applies to, " +
+			"one of " + ", ".join(sorted(anomalyStories)) + " (may be repeated)")
+	argParser.add_argument("--deep", action="store_true",
+		help="fewer children per family, so the tree has many more generations")
+	argParser.add_argument("-o", "--output", default=None, help="file to write (default: standard output)")
+	args = argParser.parse_args()
+
+	if args.output:
+		writeTree(args.output, args.individuals, args.seed, dict(args.anomaly), args.deep)
+	else:
+		for line in generateLines(args.individuals, args.seed, dict(args.anomaly), args.deep):
+			sys.stdout.write(line + "\n")
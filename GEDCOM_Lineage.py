@@ -0,0 +1,279 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|Parent and child links of the whole tree, read once from the database               |#
+#|IDs are numbered 0..n-1 and the links kept in flat integer arrays, so walking up or  |#
+#|down the tree is a few array lookups per person instead of a join per generation.   |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import array
+
+# Ordinals of cousin degrees, after these they are written "11th", "21st"...
+ordinals = ["first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth"]
+
+# "first", "second"... "11th", "21st", "22nd"
+def ordinal(n):
+
+	if n <= len(ordinals):
+		return ordinals[n - 1]
+
+	if n % 100 in (11, 12, 13):
+		return str(n) + "th"
+
+	return str(n) + {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+
+# Index the individuals, families and child links of a database
+def loadLineage(conn):
+
+	curs = conn.cursor()
+
+	ids = [row[0] for row in curs.execute('SELECT id FROM individuals ORDER BY rowid')]
+	families = curs.execute('SELECT id, husbID, wifeID FROM families ORDER BY rowid').fetchall()
+	children = curs.execute('SELECT childID, famID FROM children ORDER BY rowid').fetchall()
+
+	return Lineage(ids, families, children)
+
+# Adjacency lists of nodes 0..count-1 from (node, neighbour) pairs, in compressed rows:
+# the neighbours of node i are targets[starts[i]:starts[i + 1]], in the order of pairs
+def compressedRows(count, pairs):
+
+	starts = array.array('i', bytes(4 * (count + 1)))
+
+	for (node, neighbour) in pairs:
+		starts[node + 1] += 1
+
+	for i in range(count):
+		starts[i + 1] += starts[i]
+
+	targets = array.array('i', bytes(4 * starts[count]))
+	filled = starts[:count]
+
+	for (node, neighbour) in pairs:
+		targets[filled[node]] = neighbour
+		filled[node] += 1
+
+	return (starts, targets)
+
+# Name of the relationship of A to B, given how many generations each is below their
+# closest common ancestor ("first cousin once removed", "grandparent"...)
+def relationshipName(generationsA, generationsB):
+
+	if generationsA == 0 and generationsB == 0:
+		return "self"
+
+	# A is the common ancestor, B descends from them
+	if generationsA == 0:
+		return ["parent", "grandparent"][generationsB - 1] if generationsB <= 2 else \
+			"great-" * (generationsB - 2) + "grandparent"
+
+	if generationsB == 0:
+		return ["child", "grandchild"][generationsA - 1] if generationsA <= 2 else \
+			"great-" * (generationsA - 2) + "grandchild"
+
+	if generationsA == 1 and generationsB == 1:
+		return "sibling"
+
+	# A is the sibling of one of B's ancestors, or the other way around
+	if generationsA == 1:
+		return "great-" * (generationsB - 2) + "aunt/uncle"
+
+	if generationsB == 1:
+		return "great-" * (generationsA - 2) + "niece/nephew"
+
+	degree = min(generationsA, generationsB) - 1
+	removed = abs(generationsA - generationsB)
+
+	name = ordinal(degree) + " cousin"
+
+	if removed == 1:
+		name += " once removed"
+	elif removed == 2:
+		name += " twice removed"
+	elif removed > 2:
+		name += " " + str(removed) + " times removed"
+
+	return name
+
+# The tree as integer arrays
+# ids are the individual IDs, families (family ID, husband ID, wife ID) and children
+# (child ID, family ID). Links to IDs that aren't in ids are left out.
+class Lineage:
+
+	def __init__(self, ids, families, children):
+
+		self.ids = list(ids)
+		self.index = {indID: i for (i, indID) in enumerate(self.ids)}
+
+		count = len(self.ids)
+
+		# spouses of each family as indexes, -1 for a missing one
+		self.familyIDs = []
+		self.husbands = array.array('i')
+		self.wives = array.array('i')
+
+		familyIndex = {}
+
+		for (famID, husbID, wifeID) in families:
+			familyIndex[famID] = len(self.familyIDs)
+			self.familyIDs.append(famID)
+			self.husbands.append(self.index.get(husbID, -1))
+			self.wives.append(self.index.get(wifeID, -1))
+
+		# (child, parent) for both parents of every child link
+		links = []
+
+		for (childID, famID) in children:
+
+			child = self.index.get(childID)
+			family = familyIndex.get(famID)
+
+			if child is None or family is None:
+				continue
+
+			for parent in (self.husbands[family], self.wives[family]):
+				if parent >= 0 and parent != child:
+					links.append((child, parent))
+
+		(self.parentStarts, self.parents) = compressedRows(count, links)
+		(self.childStarts, self.children) = compressedRows(count, [(parent, child) for (child, parent) in links])
+
+	def __len__(self):
+		return len(self.ids)
+
+	# Index of an ID, KeyError if it isn't in the tree
+	def indexOf(self, indID):
+
+		try:
+			return self.index[indID]
+		except KeyError:
+			raise KeyError("no individual " + str(indID)) from None
+
+	# Breadth first walk from node along starts/targets, up to maxDepth steps away (None: no limit)
+	# Returns {node: steps} in the order they are reached, node itself at 0
+	# Each node is counted once, at its smallest number of steps
+	def walk(self, node, starts, targets, maxDepth=None):
+
+		depths = {node: 0}
+		frontier = [node]
+		depth = 0
+
+		while frontier and (maxDepth is None or depth < maxDepth):
+
+			depth += 1
+			following = []
+
+			for current in frontier:
+				for i in range(starts[current], starts[current + 1]):
+					neighbour = targets[i]
+
+					if neighbour not in depths:
+						depths[neighbour] = depth
+						following.append(neighbour)
+
+			frontier = following
+
+		return depths
+
+	def walkUp(self, node, maxDepth=None):
+		return self.walk(node, self.parentStarts, self.parents, maxDepth)
+
+	def walkDown(self, node, maxDepth=None):
+		return self.walk(node, self.childStarts, self.children, maxDepth)
+
+	# The ancestors of an individual up to maxGenerations back (None: all of them)
+	# Returns [(ID, generations back)], parents first
+	def ancestors(self, indID, maxGenerations=None):
+
+		walked = self.walkUp(self.indexOf(indID), maxGenerations)
+
+		return [(self.ids[node], depth) for (node, depth) in walked.items() if depth > 0]
+
+	# The descendants of an individual down to maxGenerations (None: all of them)
+	# Returns [(ID, generations down)], children first
+	def descendants(self, indID, maxGenerations=None):
+
+		walked = self.walkDown(self.indexOf(indID), maxGenerations)
+
+		return [(self.ids[node], depth) for (node, depth) in walked.items() if depth > 0]
+
+	# Closest common ancestors of two nodes, looking up to maxDepth generations above each
+	# Returns (generations below them of a, of b, [ancestor nodes]) or None if they aren't related
+	# The ancestors are the ones with the fewest generations in total between a and b,
+	# a node counts as its own ancestor (so a parent is the common ancestor of itself and its child)
+	def closestAncestors(self, a, b, maxDepth=None):
+
+		aboveA = self.walkUp(a, maxDepth)
+		aboveB = self.walkUp(b, maxDepth)
+
+		if len(aboveB) < len(aboveA):
+			(smaller, larger) = (aboveB, aboveA)
+		else:
+			(smaller, larger) = (aboveA, aboveB)
+
+		best = None
+		found = []
+
+		for (node, depth) in smaller.items():
+
+			if node not in larger:
+				continue
+
+			distance = depth + larger[node]
+
+			if best is None or distance < best:
+				best = distance
+				found = [node]
+			elif distance == best:
+				found.append(node)
+
+		if not found:
+			return None
+
+		return (aboveA[found[0]], aboveB[found[0]], found)
+
+	# How two individuals are related through their closest common ancestors
+	# Returns (generations of A below them, generations of B below them, [ancestor IDs])
+	# or None if they have no common ancestor within maxGenerations
+	def kinship(self, idA, idB, maxGenerations=None):
+
+		closest = self.closestAncestors(self.indexOf(idA), self.indexOf(idB), maxGenerations)
+
+		if closest is None:
+			return None
+
+		(generationsA, generationsB, nodes) = closest
+
+		return (generationsA, generationsB, [self.ids[node] for node in nodes])
+
+	# What A is to B ("first cousin", "great-grandparent"...), None if they aren't related
+	def relationship(self, idA, idB, maxGenerations=None):
+
+		kin = self.kinship(idA, idB, maxGenerations)
+
+		if kin is None:
+			return None
+
+		return relationshipName(kin[0], kin[1])
+
+	# Families whose spouses have a common ancestor at most maxDegree + 1 generations above both
+	# of them: siblings (or a parent and child) for 0, first cousins and closer for 1 (the default)...
+	# Only that many generations are walked above each spouse, so the work per family doesn't
+	# grow with the size of the tree. Yields (family ID, husband ID, wife ID, relationship of the
+	# husband to the wife, [common ancestor IDs]), in family order.
+	def cousinMarriages(self, maxDegree=1):
+
+		for (family, famID) in enumerate(self.familyIDs):
+
+			husband = self.husbands[family]
+			wife = self.wives[family]
+
+			if husband < 0 or wife < 0:
+				continue
+
+			closest = self.closestAncestors(husband, wife, maxDegree + 1)
+
+			if closest is None:
+				continue
+
+			(generationsH, generationsW, nodes) = closest
+
+			yield (famID, self.ids[husband], self.ids[wife], relationshipName(generationsH, generationsW),
+				[self.ids[node] for node in nodes])
@@ -4,12 +4,21 @@
 #|individuals and the families, along with other information found in the gedcom file|#
 #-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
 
-import sys
+import os
+import mmap
+import hashlib
 import math
-import datetime
-from prettytable import PrettyTable
+import locale
+import itertools
+import argparse
+import concurrent.futures
 
 import GEDCOM_Database as db
+import GEDCOM_Report as report
+import GEDCOM_Stats as stats
+import GEDCOM_Sinks as sinks
+from GEDCOM_Records import Individual, Family
+from GEDCOM_Dates import parseDate
 
 # Which tags can be on which lines
 tagRules = [
@@ -29,35 +38,96 @@ tagRules = [
 	(1, 'WIFE'),
 	(1, 'CHIL'),
 	(1, 'DIV'),
-	(2, 'DATE')
+	(1, 'NOTE'),
+	(1, 'SOUR'),
+	(2, 'DATE'),
+	(2, 'PLAC'),
+	(2, 'NOTE'),
+	(2, 'SOUR')
 ]
 
-#dictionary of months with numeric values as the keys
-monthnums = {
-	'JAN':1,
-	'FEB':2,
-	'MAR':3,
-	'APR':4,
-	'MAY':5,
-	'JUN':6,
-	'JUL':7,
-	'AUG':8,
-	'SEP':9,
-	'OCT':10,
-	'NOV':11,
-	'DEC':12
+# tagRules as a set, so checking a line is one hash lookup
+validTags = frozenset(tagRules)
+
+# Deepest level in tagRules
+maxLevel = max(level for (level, tag) in tagRules)
+
+# Handlers for the lines we keep, each fills in the individual or family being read
+def startIndividual(ind, fam, args):
+	ind.id = args[0]
+
+def setName(ind, fam, args):
+	ind.lastName = args[-1][1:-1]
+	ind.firstName = " ".join(args[0:-1])
+
+def setGender(ind, fam, args):
+	ind.gender = args[0]
+
+# The date of a DATE line, timed under parse.dates while stats are enabled
+# (how many were parsed and how many came from the cache is in the dates.* counters)
+def dateOf(args):
+
+	if stats.enabled:
+		with stats.timer("parse.dates"):
+			return parseDate(" ".join(args))
+
+	return parseDate(" ".join(args))
+
+def setBirth(ind, fam, args):
+	ind.birth = dateOf(args)
+
+def setDeath(ind, fam, args):
+	ind.death = dateOf(args)
+
+def startFamily(ind, fam, args):
+	fam.id = args[0]
+
+def setHusband(ind, fam, args):
+	fam.husbID = args[0]
+
+def setWife(ind, fam, args):
+	fam.wifeID = args[0]
+
+def addChild(ind, fam, args):
+	fam.children.append(args[0])
+
+def setMarried(ind, fam, args):
+	fam.married = dateOf(args)
+
+def setDivorced(ind, fam, args):
+	fam.divorced = dateOf(args)
+
+# Which handler reads which line: (level, tag, tag of the enclosing line) -> handler
+# Valid lines that aren't here (HEAD, FAMC, PLAC...) are skipped
+tagHandlers = {
+	(0, 'INDI', None): startIndividual,
+	(1, 'NAME', 'INDI'): setName,
+	(1, 'SEX', 'INDI'): setGender,
+	(2, 'DATE', 'BIRT'): setBirth,
+	(2, 'DATE', 'DEAT'): setDeath,
+	(0, 'FAM', None): startFamily,
+	(1, 'HUSB', 'FAM'): setHusband,
+	(1, 'WIFE', 'FAM'): setWife,
+	(1, 'CHIL', 'FAM'): addChild,
+	(2, 'DATE', 'MARR'): setMarried,
+	(2, 'DATE', 'DIV'): setDivorced
 }
 
+# (level, tag) of each tag rule, by the bytes of the level and tag as written in a file
+byteRules = {(str(level).encode('ascii'), tag.encode('ascii')): (level, tag) for (level, tag) in tagRules}
+
+# Lines with a handler somewhere, the only ones whose values the mapped tokenizer decodes
+storedTags = frozenset((level, tag) for (level, tag, parent) in tagHandlers)
 
 #converts gedcom date sting into a python date time (yr, month, day)
+#returns None if it isn't a date (see GEDCOM_Dates.parseDate)
 def dateconvert(date):
-    #converts date1 to the GEDCOM date format into python timedate format
-    d = date.split()
-    day = int(d[0])
-    month = int(monthnums[d[1]])
-    year = int(d[2])
+	parsed = parseDate(date)
+
+	if parsed is None:
+		return None
 
-    return datetime.date(year, month, day)
+	return parsed.date()
 
 
 
@@ -96,175 +166,483 @@ def parseLine(line):
 
 		# if we find a matching tag rule, and the level checks out
 		# tag is valid
-		valid = (not badOrder) and ((level, tag) in tagRules)
+		valid = (not badOrder) and ((level, tag) in validTags)
 
 	return (valid, level, tag, args)
 
 
 
-def parseText(database, gedText):
+# The (level, tag, args) of each valid line, as found by parseLine
+# Other lines with a level come out as (level, None, None), they still close the lines
+# above them (a DATE under a CHR line isn't the date of the BIRT before it)
+def lineTokens(lines):
+
+	for line in lines:
+
+		(valid, level, tag, args) = parseLine(line)
+
+		if (valid):
+			yield (level, tag, args)
+		elif (level >= 0):
+			yield (level, None, None)
+
+# The lines in bytes start to end of a memory mapped file
+def mappedLines(buffer, start=0, end=None):
+
+	buffer.seek(start)
+
+	if end is None or end >= len(buffer):
+		return iter(buffer.readline, b'')
+
+	return itertools.takewhile(lambda line: buffer.tell() <= end, iter(buffer.readline, b''))
+
+# Same tokens as lineTokens, for bytes start to end of a memory mapped file
+# Lines are split as bytes and looked up in byteRules, so levels and tags are never decoded,
+# only the values of lines that can be stored (names, dates, IDs) are
+def mappedTokens(buffer, start=0, end=None, encoding=None):
+
+	encoding = encoding or locale.getpreferredencoding(False)
+
+	lines = mappedLines(buffer, start, end)
+	if stats.enabled:
+		lines = stats.counted("lines", lines)
+
+	for line in lines:
+
+		words = line.split()
+		if len(words) < 2:
+			continue
+
+		# order is switched for INDI and FAM
+		if len(words) >= 3 and (words[2] == b'INDI' or words[2] == b'FAM'):
+
+			rule = byteRules.get((words[0], words[2]))
+			if rule is not None:
+				yield rule + ([word.decode(encoding) for word in words[1:2] + words[3:]],)
+			elif words[0].isdigit():
+				yield (int(words[0]), None, None)
+
+			continue
+
+		rule = byteRules.get((words[0], words[1]))
+
+		# INDI and FAM should have been found in block above
+		if rule is None or rule[1] == 'INDI' or rule[1] == 'FAM':
+			if words[0].isdigit():
+				yield (int(words[0]), None, None)
+			continue
+
+		if rule in storedTags:
+			yield rule + ([word.decode(encoding) for word in words[2:]],)
+		else:
+			yield rule + (None,)
+
+# Assemble finished records from (level, tag, args) tokens of valid lines
+# Yields Individual and Family records one at a time,
+# as soon as the level 0 line that closes them has been read
+# flushAtEnd also yields the last record, for when the lines are followed by more
+# lines that start with a level 0 line (see parseFileSharded)
+def assembleRecords(tokens, flushAtEnd=False):
+
+	# The records being filled in
+	ind = Individual()
+	fam = Family()
+
+	# parents[level] is the tag of the last valid line at that level,
+	# deeper entries are cleared so a line never sees a parent from an earlier record
+	parents = [None] * (maxLevel + 2)
+
+	for (level, newTag, args) in tokens:
+
+		# A line without a tag rule (CHR, BURI...) is nobody's parent
+		if (newTag == None):
+			if (level <= maxLevel):
+				parents[level] = None
+				parents[level + 1] = None
+			continue
+
+		# If we're at level zero, we may have captured a person or family
+		if (level == 0):
+
+			# Emit a finished individual
+			if (ind.lastName != None):
+
+				yield ind
+				ind = Individual()
+
+			# Emit a finished family
+			elif (fam.husbID != None):
+
+				yield fam
+				fam = Family()
+
+			parent = None
+
+		else:
+			parent = parents[level - 1]
+
+		parents[level] = newTag
+		parents[level + 1] = None
+
+		# Assign attributes based on the tag parsed
+		handler = tagHandlers.get((level, newTag, parent))
+		if (handler != None):
+			handler(ind, fam, args)
+
+	# The next level 0 line would have closed this record
+	if (flushAtEnd):
+		if (ind.lastName != None):
+			yield ind
+		elif (fam.husbID != None):
+			yield fam
+
+# Assemble finished records from an iterable of GEDCOM lines (see assembleRecords)
+# While stats are enabled, reading and tokenizing the lines is timed under parse.tokenize
+def parseRecords(lines, flushAtEnd=False):
+
+	if stats.enabled:
+		tokens = stats.timedItems("parse.tokenize", lineTokens(stats.counted("lines", lines)))
+	else:
+		tokens = lineTokens(lines)
+
+	return assembleRecords(tokens, flushAtEnd)
+
+# Assemble the records in bytes start to end of a file, read through a memory map
+# instead of line by line (see mappedTokens). Repeated runs are served from the page cache.
+def parseRecordsMapped(filePath, start=0, end=None, flushAtEnd=False):
+
+	with open(filePath, 'rb') as file:
+
+		# an empty file can't be mapped
+		if os.fstat(file.fileno()).st_size == 0:
+			return
+
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+
+			tokens = mappedTokens(buffer, start, end)
+			if stats.enabled:
+				tokens = stats.timedItems("parse.tokenize", tokens)
+
+			yield from assembleRecords(tokens, flushAtEnd)
+
+# Hand each record to the database as soon as it is finished
+# Rows are written in batches of chunkSize (see GEDCOM_Database.BulkLoader)
+# source is the file the records come from, for persistent databases (see parseChangedFiles)
+# onError is called with the message of every rejected record (default: print it)
+# Returns false if any record was rejected
+def loadRecords(database, records, chunkSize=10000, source=None, onError=print):
 
 	noErrors = True
 
-	# Zero out variables
-	indID = None
-	firstName = None
-	lastName = None
-	gender = None
-	birth = None
-	death = None
+	# records are usually read as they are loaded, time the reading apart from the rest
+	if stats.enabled:
+		records = stats.timedItems("parse", records)
 
-	famID = None
-	husband = None
-	wife = None
-	children = []
-	married = None
-	divorced = None
+	with stats.timer("load"), db.BulkLoader(database, chunkSize, source, onError) as loader:
 
-	lastTag = None
+		for record in records:
 
-	# loop through lines
-	for line in gedText.splitlines():
+			if isinstance(record, Individual):
+				noErrors = loader.addIndividual(record) and noErrors
 
-		valid = False
-		level = -1
-		newTag = None
-		args = None
+			else:
+				noErrors = loader.addFamily(record) and noErrors
 
-		(valid, level, newTag, args) = parseLine(line)
+				for child in record.children:
+					noErrors = loader.addChild(child, record.id) and noErrors
 
-		# Make sure this line is valid before we do anything
-		if (valid):
+	return (noErrors and loader.noErrors)
 
-			# If we're at level zero, we may have captured a person or family
-			if (level == 0):
-
-				# Add an individual to the database
-				if (lastName != None):
-
-					noErrors = db.addIndividual(database, indID, firstName, lastName, gender, birth, death) and noErrors
-
-					indID = None
-					lastName = None
-					firstName = None
-					gender = None
-					birth = None
-					death = None
-
-				# Add a family to the database
-				elif (husband != None):
-
-					noErrors  = db.addFamily(database, famID, married, divorced, husband, wife) and noErrors
-
-					for child in children:
-						noErrors  = db.addChild(database, child, famID) and noErrors
-
-					famID = None
-					husband = None
-					wife = None
-					married = None
-					divorced = None
-					children = []
-
-			# Assign attributes based on the tag parsed
-			if(newTag == 'INDI'):
-				indID = args[0]
-			elif (newTag == 'NAME'):
-				lastName = args[-1][1:-1]
-				firstName = " ".join(args[0:-1])
-			elif (newTag == 'SEX'):
-				gender = args[0]
-			elif (lastTag == 'BIRT' and newTag == 'DATE'):
-				birth = dateconvert(" ".join(args))
-			elif (lastTag == 'DEAT' and newTag == 'DATE'):
-				death = dateconvert(" ".join(args))
-
-			if (newTag == 'FAM'):
-				famID = args[0]
-			elif (newTag == 'HUSB'):
-				husband = args[0]
-			elif (newTag == 'WIFE'):
-				wife = args[0]
-			elif (newTag == 'CHIL'):
-				children.append(args[0])
-			elif (lastTag == 'MARR' and newTag == 'DATE'):
-				married = dateconvert(" ".join(args))
-			elif (lastTag == 'DIV' and newTag == 'DATE'):
-				divorced = dateconvert(" ".join(args))
-
-			# Keep track of the tag before this one for birth and death dates
-			lastTag = newTag
-
-	valid = db.validateDatabase(database)
+# Parse any iterable of lines (a list, an open file...) into the database
+# Only one record is held in memory at a time
+# validate is the validation engine to run afterwards, GEDCOM_Database.validateChanges
+# (SQL, only re-checks what this call added), GEDCOM_Database.validateDatabase (SQL, full)
+# or GEDCOM_Validator.validateDatabase (in memory, full)
+def parseLines(database, lines, validate=db.validateChanges):
+
+	noErrors = loadRecords(database, parseRecords(lines))
+
+	valid = validate(database)
 
 	return (noErrors and valid)
 
-def parseFile(database, filePath):
+def parseText(database, gedText, validate=db.validateChanges):
+
+	return parseLines(database, gedText.splitlines(), validate)
+
+# Stream the file line by line instead of reading it all at once
+# mapped reads it through a memory map instead (see parseRecordsMapped)
+def parseFile(database, filePath, validate=db.validateChanges, mapped=False):
+
+	if mapped:
+		noErrors = loadRecords(database, parseRecordsMapped(filePath))
+		valid = validate(database)
+		return (noErrors and valid)
+
+	with open(filePath) as file:
+		return parseLines(database, file, validate)
+
+# The records of a file, read line by line or through a memory map
+def fileRecords(filePath, mapped=False):
+
+	if mapped:
+		yield from parseRecordsMapped(filePath)
+		return
 
 	with open(filePath) as file:
-		return parseText(database, file.read())
-
-def printDatabase(database):
-
-	# Table for individuals
-	INDI_tbl = PrettyTable(field_names = [
-		"ID",
-		"First Name",
-		"Last Name",
-		"Sex",
-		"Birth",
-		"Death"
-	])
-
-	# Table for families
-	FAM_tbl = PrettyTable(field_names = [
-		"Family ID",
-		"Married",
-		"Divorced",
-		"Husband ID",
-		"Husband First Name",
-		"Husband Last Name",
-		"Wife ID",
-		"Wife First Name",
-		"Wife Last Name",
-		"Children"
-	])
-
-	#adding information from database into individual prettytable
-	for i in db.getIndividuals(database):
-		INDI_tbl.add_row([x for x in i])
-
-	#prints table of individuals
-	print(INDI_tbl)
-
-	#adding information from database into family prettytable
-	for k in db.getFamilies(database):
-		fam = [x for x in k]
-		husb = db.getIndividual(database, fam[3])
-		wife = db.getIndividual(database, fam[4])
-		fam.insert(4, husb[1])
-		fam.insert(5, husb[2])
-		fam.insert(7, wife[1])
-		fam.insert(8, wife[2])
-		fam.insert(9, [x[0] for x in db.getChildren(database, fam[0])])
-
-		FAM_tbl.add_row(fam)
-
-	#prints table of families
-	print(FAM_tbl)
+		yield from parseRecords(file)
+
+# Tokenize a file and assemble all of its records (runs in a worker process)
+def readRecords(filePath, mapped=False):
+
+	return list(fileRecords(filePath, mapped))
+
+# Assemble all the records of a GEDCOM text (runs in a worker process)
+def textRecords(gedText):
+
+	return list(parseRecords(gedText.splitlines()))
+
+# Parse several files, same result and output as calling parseFile on each in order
+# Tokenizing and record assembly run in up to jobs worker processes (default: one per core),
+# this process does all the database writes and validation, in file order
+def parseFiles(database, filePaths, jobs=None, validate=db.validateChanges, mapped=False):
+
+	noErrors = True
+
+	if jobs == 1 or len(filePaths) <= 1:
+		for filePath in filePaths:
+			noErrors = parseFile(database, filePath, validate, mapped) and noErrors
+
+		return noErrors
+
+	with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+
+		for records in pool.map(readRecords, filePaths, [mapped] * len(filePaths)):
+			loaded = loadRecords(database, records)
+			valid = validate(database)
+			noErrors = loaded and valid and noErrors
+
+	return noErrors
+
+# SHA-256 of a file's contents and its size in bytes
+def fileDigest(filePath, blockSize=1 << 20):
+
+	digest = hashlib.sha256()
+	size = 0
+
+	with open(filePath, 'rb') as file:
+		for block in iter(lambda: file.read(blockSize), b''):
+			digest.update(block)
+			size += len(block)
+
+	return (digest.hexdigest(), size)
+
+# Load only the files that changed since they were last loaded into a database opened
+# with GEDCOM_Database.dbInit(persistent=True). Unchanged files are skipped, a changed
+# file's old records are taken out before it is loaded again.
+# The whole database is validated once at the end
+def parseChangedFiles(database, filePaths, jobs=None, validate=db.validateChanges, mapped=False):
+
+	noErrors = True
+
+	changed = []
+	for filePath in filePaths:
+
+		source = os.path.realpath(filePath)
+		(digest, size) = fileDigest(filePath)
+
+		if db.getSource(database, source) == (digest, size):
+			continue
+
+		db.removeSource(database, source)
+		changed.append((filePath, source, digest, size))
+
+	if jobs == 1 or len(changed) <= 1:
+		recordLists = (fileRecords(filePath, mapped) for (filePath, source, digest, size) in changed)
+		noErrors = loadChangedFiles(database, changed, recordLists)
+
+	else:
+		with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+			recordLists = pool.map(readRecords,
+				[filePath for (filePath, source, digest, size) in changed], [mapped] * len(changed))
+			noErrors = loadChangedFiles(database, changed, recordLists)
+
+	valid = validate(database)
+
+	return (noErrors and valid)
+
+# Load the records of each changed file and remember what was loaded (see parseChangedFiles)
+def loadChangedFiles(database, changed, recordLists):
+
+	noErrors = True
+
+	for ((filePath, source, digest, size), records) in zip(changed, recordLists):
+		noErrors = loadRecords(database, records, source=source) and noErrors
+		db.setSource(database, source, digest, size)
+
+	return noErrors
+
+# Split a file into about count byte ranges [start, end) that each begin on a valid
+# level 0 line, so every record lies entirely inside one range
+def shardFile(filePath, count):
+
+	size = os.path.getsize(filePath)
+	starts = [0]
+
+	with open(filePath, 'rb') as file:
+
+		for i in range(1, count):
+
+			# back up one byte so a level 0 line starting right at the split point is kept
+			file.seek(max(size * i // count, starts[-1] + 1) - 1)
+			file.readline()
+
+			while True:
+				lineStart = file.tell()
+				line = file.readline()
+
+				if not line:
+					lineStart = size
+					break
+
+				(valid, level, tag, args) = parseLine(line.decode(locale.getpreferredencoding(False)))
+				if valid and level == 0:
+					break
+
+			if lineStart >= size:
+				break
+
+			if lineStart > starts[-1]:
+				starts.append(lineStart)
+
+	return list(zip(starts, starts[1:] + [size]))
+
+# Assemble the records in one byte range of a file (runs in a worker process)
+# Every range but the last is followed by a level 0 line, so its last record is finished
+def readShard(filePath, start, end, last, mapped=False):
+
+	if mapped:
+		return list(parseRecordsMapped(filePath, start, end, flushAtEnd=not last))
+
+	encoding = locale.getpreferredencoding(False)
+
+	def lines(file):
+		file.seek(start)
+		while file.tell() < end:
+			yield file.readline().decode(encoding)
+
+	with open(filePath, 'rb') as file:
+		return list(parseRecords(lines(file), flushAtEnd=not last))
+
+# Parse one file in up to jobs worker processes (default: one per core)
+# The file is split at level 0 lines, the pieces are parsed at the same time and their
+# records are loaded in file order, so the result is the same as parseFile
+def parseFileSharded(database, filePath, jobs=None, validate=db.validateChanges, mapped=False):
+
+	shards = shardFile(filePath, jobs or os.cpu_count() or 1)
+
+	with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+
+		pieces = pool.map(readShard,
+			[filePath] * len(shards),
+			[start for (start, end) in shards],
+			[end for (start, end) in shards],
+			[i == len(shards) - 1 for i in range(len(shards))],
+			[mapped] * len(shards))
+
+		noErrors = loadRecords(database, itertools.chain.from_iterable(pieces))
+
+	valid = validate(database)
+
+	return (noErrors and valid)
+
+# Print the individual and family reports in one of GEDCOM_Report.reportFormats,
+# to out (default: standard output), then write the lists to the sink
+# (default: GEDCOM_Sinks.defaultSink)
+# With a GEDCOM_Database.ReaderPool, the list queries run at the same time on its connections,
+# the output is the same (the reports are streamed from database either way)
+def printDatabase(database, format="table", out=None, sink=None, pool=None):
+
+	report.writeDatabase(database, format, out)
 
 	# print necessary lists
-	db.printDeceased(database)
-	db.printLivingMarried(database)
-	db.printMultipleBirths(database)
-	db.printOrphans(database)
-	db.printLargeAgeDifferences(database)
+	with stats.timer("report.lists"):
+
+		if pool is not None:
+			db.printListsPooled(pool, sink)
+			return
+
+		db.printDeceased(database, sink)
+		db.printLivingMarried(database, sink)
+		db.printMultipleBirths(database, sink)
+		db.printOrphans(database, sink)
+		db.printLargeAgeDifferences(database, sink)
+
+if __name__ == "__main__":
+
+	argParser = argparse.ArgumentParser(description="Validate GEDCOM files and print their individuals and families")
+	argParser.add_argument("files", nargs="*", help="GEDCOM files to load, in order")
+	argParser.add_argument("-j", "--jobs", type=int, default=None,
+		help="worker processes used to parse the files (default: one per core)")
+	argParser.add_argument("--shard", action="store_true",
+		help="split each file across the workers instead of giving each worker whole files")
+	argParser.add_argument("--mmap", action="store_true",
+		help="read the files through a memory map and tokenize their bytes directly")
+	argParser.add_argument("--persist", action="store_true",
+		help="keep GEDCOM.db between runs and only load the files that changed since the last one")
+	argParser.add_argument("--readers", type=int, default=0,
+		help="run the validation rules and lists through this many read-only connections at once " +
+			"(puts GEDCOM.db in write-ahead log mode)")
+	argParser.add_argument("--format", choices=sorted(report.reportFormats), default="table",
+		help="how the individual and family reports are written (default: table)")
+	argParser.add_argument("-o", "--output", default=None,
+		help="write the individual and family reports to this file instead of standard output")
+	argParser.add_argument("--anomalies", choices=sorted(sinks.sinkFormats), default="text",
+		help="how anomalies and lists are written to standard output, none skips them (default: text)")
+	argParser.add_argument("--stats", nargs="?", const="-", default=None, metavar="FILE",
+		help="time each phase and count lines, records, anomalies and queries, then print a " +
+			"summary to standard error (or save it as JSON to FILE)")
+	args = argParser.parse_args()
+
+	if args.stats:
+		stats.enable()
+
+	sinks.setDefault(sinks.sinkFormats[args.anomalies]())
+
+	if args.files:
+
+		wal = args.readers > 0
+
+		if args.persist:
+			database = db.dbInit("GEDCOM.db", persistent=True, wal=wal)
+		else:
+			database = db.dbInit("GEDCOM.db", fastLoad=True, wal=wal)
+
+		# readers see what the loader has committed, every validation runs the rules on all of them
+		# (a full validation each time, instead of re-checking only what the file added)
+		pool = db.ReaderPool("GEDCOM.db", args.readers) if wal else None
+		validate = (lambda conn: db.validatePooled(pool)) if wal else db.validateChanges
 
-if len(sys.argv) > 1:
+		if args.persist:
+			parseChangedFiles(database, args.files, args.jobs, validate, args.mmap)
 
-	database = db.dbInit("GEDCOM.db")
+		elif args.shard:
+			for filePath in args.files:
+				parseFileSharded(database, filePath, args.jobs, validate, args.mmap)
+
+		else:
+			parseFiles(database, args.files, args.jobs, validate, args.mmap)
+
+		if args.output:
+			with open(args.output, "w") as out:
+				printDatabase(database, args.format, out, pool=pool)
+		else:
+			printDatabase(database, args.format, pool=pool)
 
-	for filepath in sys.argv[1:]:
-		parseFile(database, filepath)
+		if pool is not None:
+			pool.close()
 
-	printDatabase(database)
+	if args.stats == "-":
+		stats.printSummary()
+	elif args.stats:
+		stats.writeJson(args.stats)
@@ -0,0 +1,93 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|Record types passed between the parser, the database loader, the validators and   |#
+#|the reports. They use __slots__ so a record costs no more than a tuple, and can    |#
+#|still be indexed like the database rows they replace (ind[4] is the birthday).    |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+# Shared tuple-like behaviour, subclasses list their database columns in columns
+class Record:
+
+	__slots__ = ()
+	columns = ()
+
+	# Index by column number, like a database row
+	def __getitem__(self, index):
+
+		if isinstance(index, slice):
+			return tuple(self)[index]
+
+		return getattr(self, self.columns[index])
+
+	def __len__(self):
+		return len(self.columns)
+
+	def __iter__(self):
+		for column in self.columns:
+			yield getattr(self, column)
+
+	def __eq__(self, other):
+
+		if isinstance(other, (Record, tuple, list)):
+			return tuple(self) == tuple(other)
+
+		return NotImplemented
+
+	__hash__ = None
+
+	def __repr__(self):
+		return type(self).__name__ + repr(tuple(self))
+
+	# Row factory for sqlite3 cursors
+	@classmethod
+	def fromRow(cls, cursor, row):
+		return cls(*row)
+
+# A row of the individuals table
+class Individual(Record):
+
+	__slots__ = ('id', 'firstName', 'lastName', 'gender', 'birth', 'death')
+	columns = __slots__
+
+	def __init__(self, id=None, firstName=None, lastName=None, gender=None, birth=None, death=None):
+
+		self.id = id
+		self.firstName = firstName
+		self.lastName = lastName
+		self.gender = gender
+		self.birth = birth
+		self.death = death
+
+# A row of the families table, plus the IDs of its children
+# Only the table columns take part in indexing, len() and comparisons
+class Family(Record):
+
+	__slots__ = ('id', 'married', 'divorced', 'husbID', 'wifeID', 'children')
+	columns = ('id', 'married', 'divorced', 'husbID', 'wifeID')
+
+	def __init__(self, id=None, married=None, divorced=None, husbID=None, wifeID=None, children=None):
+
+		self.id = id
+		self.married = married
+		self.divorced = divorced
+		self.husbID = husbID
+		self.wifeID = wifeID
+		self.children = [] if children is None else children
+
+# One row found by a validation rule or a list: the rule ID ("US23"), whether it is an
+# "ANOMALY" or a "LIST" row, the IDs involved, and the message as a format string plus the
+# values that fill it in. The message is only put together when text() is called.
+class Anomaly(Record):
+
+	__slots__ = ('rule', 'kind', 'ids', 'template', 'args')
+	columns = __slots__
+
+	def __init__(self, rule=None, kind=None, ids=(), template=None, args=()):
+
+		self.rule = rule
+		self.kind = kind
+		self.ids = ids
+		self.template = template
+		self.args = args
+
+	def text(self):
+		return self.template.format(*self.args)
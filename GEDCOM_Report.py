@@ -0,0 +1,167 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|Individual and family reports                                                      |#
+#|The table format lines up a PrettyTable, so it holds every row until the end. The   |#
+#|csv, jsonl and fixed formats write each row as it comes off the database cursor.    |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import csv
+import sys
+import json
+from prettytable import PrettyTable
+
+import GEDCOM_Database as db
+import GEDCOM_Stats as stats
+
+# Columns of each report as (key, title, width), the key names the field in jsonl output,
+# the title heads the column and the width is used by the fixed format
+individualColumns = [
+	("id", "ID", 10),
+	("firstName", "First Name", 20),
+	("lastName", "Last Name", 20),
+	("gender", "Sex", 3),
+	("birth", "Birth", 10),
+	("death", "Death", 10)
+]
+
+familyColumns = [
+	("id", "Family ID", 10),
+	("married", "Married", 10),
+	("divorced", "Divorced", 10),
+	("husbID", "Husband ID", 10),
+	("husbFirstName", "Husband First Name", 20),
+	("husbLastName", "Husband Last Name", 20),
+	("wifeID", "Wife ID", 10),
+	("wifeFirstName", "Wife First Name", 20),
+	("wifeLastName", "Wife Last Name", 20),
+	("children", "Children", 40)
+]
+
+# Buffers the rows in a PrettyTable and prints it on close
+class TableWriter:
+
+	def __init__(self, out, name, columns):
+
+		self.out = out
+		self.table = PrettyTable(field_names=[title for (key, title, width) in columns])
+
+	def writeRow(self, row):
+		self.table.add_row(list(row))
+
+	def close(self):
+		print(self.table, file=self.out)
+
+# Comma separated values, a header line then one line per row
+# Reports after the first one are separated by an empty line
+class CsvWriter:
+
+	def __init__(self, out, name, columns):
+
+		self.out = out
+		self.writer = csv.writer(out, lineterminator="\n")
+		self.writer.writerow([title for (key, title, width) in columns])
+
+	def writeRow(self, row):
+		self.writer.writerow([formatCell(value) for value in row])
+
+	def close(self):
+		self.out.write("\n")
+
+# One JSON object per row, with the report name under "table"
+class JsonLinesWriter:
+
+	def __init__(self, out, name, columns):
+
+		self.out = out
+		self.name = name
+		self.keys = [key for (key, title, width) in columns]
+
+	def writeRow(self, row):
+
+		record = {"table": self.name}
+		record.update(zip(self.keys, row))
+
+		self.out.write(json.dumps(record) + "\n")
+
+	def close(self):
+		pass
+
+# Columns padded to the widths in the column list, longer values are cut
+class FixedWidthWriter:
+
+	def __init__(self, out, name, columns):
+
+		self.out = out
+		self.widths = [width for (key, title, width) in columns]
+
+		self.writeRow([title for (key, title, width) in columns])
+		self.out.write(" ".join(["-" * width for width in self.widths]) + "\n")
+
+	def writeRow(self, row):
+
+		cells = [formatCell(value)[:width].ljust(width) for (value, width) in zip(row, self.widths)]
+
+		self.out.write(" ".join(cells).rstrip() + "\n")
+
+	def close(self):
+		self.out.write("\n")
+
+# Writer class for each report format
+reportFormats = {
+	"table": TableWriter,
+	"csv": CsvWriter,
+	"jsonl": JsonLinesWriter,
+	"fixed": FixedWidthWriter
+}
+
+# Text of one value for the csv and fixed formats
+def formatCell(value):
+
+	if value is None:
+		return ""
+
+	if isinstance(value, list):
+		return " ".join(value)
+
+	return str(value)
+
+# Rows fetched from SQLite at a time by the reports
+batchSize = 500
+
+# Individual report rows, in the order of individualColumns
+def individualRows(conn):
+
+	for ind in db.iterIndividuals(conn, batchSize):
+		yield list(ind)
+
+# Family report rows, in the order of familyColumns
+def familyRows(conn):
+
+	return db.familyReportRows(conn, batchSize)
+
+# Write one report, rows is any iterable of rows in the order of columns
+# Returns the number of rows written
+def writeReport(out, format, name, columns, rows):
+
+	with stats.timer("report." + name):
+
+		writer = reportFormats[format](out, name, columns)
+
+		count = 0
+		for row in rows:
+			writer.writeRow(row)
+			count += 1
+
+		writer.close()
+
+	stats.count("report." + name, count)
+
+	return count
+
+# Write the individual and family reports to out (default: standard output)
+# The rows are streamed from conn as they are written, one report after the other
+def writeDatabase(conn, format="table", out=None):
+
+	out = out or sys.stdout
+
+	writeReport(out, format, "individuals", individualColumns, individualRows(conn))
+	writeReport(out, format, "families", familyColumns, familyRows(conn))
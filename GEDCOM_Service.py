@@ -0,0 +1,253 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|Long running service that keeps one database open for any number of clients        |#
+#|Clients connect to a localhost port or a Unix socket and send one JSON request per |#
+#|line. GEDCOM text is parsed in worker processes, every database call runs on one   |#
+#|thread that owns the connection, so the event loop only moves bytes around.        |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import json
+import asyncio
+import argparse
+import concurrent.futures
+
+import GEDCOM_Database as db
+import GEDCOM_Parser as parser
+import GEDCOM_Stats as stats
+import GEDCOM_Sinks as sinks
+
+# Longest request or reply line, in bytes (asyncio's default of 64 KiB is a few hundred people)
+lineLimit = 64 * 1024 * 1024
+
+# Requests and their replies, one JSON object per line each way:
+#   {"op": "load", "text": GEDCOM text}
+#     adds the records and validates what changed, replies {"ok", "loaded", "valid", "errors", "anomalies"}
+#     (loaded is false if a record was rejected, errors has the messages of the rejected records,
+#     anomalies has every anomaly in the database)
+#   {"op": "validate"}  full validation, replies {"ok", "valid", "anomalies"}
+#   {"op": "lists"}     replies {"ok", "lists"} with the rows of every list
+#   {"op": "counts"}    replies {"ok", "individuals", "families"}
+# A request that can't be carried out gets {"ok": false, "error": message}, so does a request
+# longer than limit bytes (it is skipped, the connection stays usable)
+class Service:
+
+	# dbName is opened once and kept for the life of the service (default: in memory)
+	# jobs is the number of parsing processes (default: one per core)
+	def __init__(self, dbName=":memory:", jobs=None, persistent=False, limit=lineLimit):
+
+		self.dbName = dbName
+		self.persistent = persistent
+		self.limit = limit
+		self.parsePool = concurrent.futures.ProcessPoolExecutor(jobs)
+		self.dbThread = concurrent.futures.ThreadPoolExecutor(1)
+		self.database = None
+		self.server = None
+
+		# handler task -> writer of each connected client
+		self.clients = {}
+
+	# Open the database and listen on host:port (port 0 picks a free one), or on the Unix socket path
+	# A database that is kept between runs isn't put in fast load mode (see GEDCOM_Database.setFastLoad)
+	async def start(self, host="127.0.0.1", port=0, path=None):
+
+		self.database = await self.onDatabase(db.dbInit, self.dbName, not self.persistent, False, self.persistent)
+
+		if path:
+			self.server = await asyncio.start_unix_server(self.handle, path, limit=self.limit)
+		else:
+			self.server = await asyncio.start_server(self.handle, host, port, limit=self.limit)
+
+		return self.server
+
+	# Where the service is listening, (host, port) or the socket path
+	def address(self):
+		return self.server.sockets[0].getsockname()
+
+	async def serveForever(self):
+		await self.server.serve_forever()
+
+	async def close(self):
+
+		self.server.close()
+		await self.server.wait_closed()
+
+		# hang up on the clients still connected and let their handlers finish
+		for writer in self.clients.values():
+			writer.close()
+
+		await asyncio.gather(*self.clients, return_exceptions=True)
+
+		await self.onDatabase(self.database.close)
+
+		self.dbThread.shutdown()
+		self.parsePool.shutdown()
+
+	# Answer the requests of one client, in order, until it disconnects
+	async def handle(self, reader, writer):
+
+		task = asyncio.current_task()
+		self.clients[task] = writer
+
+		try:
+			while True:
+				try:
+					line = await reader.readuntil(b"\n")
+					reply = await self.reply(line)
+
+				# the last request may not end in a newline
+				except asyncio.IncompleteReadError as error:
+					if not error.partial:
+						break
+					reply = await self.reply(error.partial)
+
+				except asyncio.LimitOverrunError:
+					await skipLine(reader)
+					reply = {"ok": False, "error": "request is longer than the limit of " + str(self.limit) + " bytes"}
+
+				writer.write((json.dumps(reply) + "\n").encode())
+				await writer.drain()
+
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+
+		finally:
+			del self.clients[task]
+			writer.close()
+
+	async def reply(self, line):
+
+		try:
+			request = json.loads(line)
+			op = request["op"]
+
+			stats.count("service." + str(op))
+
+			if op == "load":
+				loop = asyncio.get_running_loop()
+				records = await loop.run_in_executor(self.parsePool, parser.textRecords, request["text"])
+
+				return await self.onDatabase(self.load, records)
+
+			if op == "validate":
+				return await self.onDatabase(self.validate)
+
+			if op == "lists":
+				return await self.onDatabase(self.lists)
+
+			if op == "counts":
+				return await self.onDatabase(self.counts)
+
+			return {"ok": False, "error": "unknown op " + repr(op)}
+
+		# a bad request or a failed query ends that request, not the connection
+		except Exception as error:
+			return {"ok": False, "error": type(error).__name__ + ": " + str(error)}
+
+	# Run function(*args) on the database thread
+	async def onDatabase(self, function, *args):
+
+		return await asyncio.get_running_loop().run_in_executor(self.dbThread, function, *args)
+
+	# The methods below run on the database thread
+
+	def load(self, records):
+
+		found = sinks.ListSink()
+		errors = []
+
+		loaded = parser.loadRecords(self.database, records, onError=errors.append)
+
+		valid = db.validateChanges(self.database, found)
+
+		return {
+			"ok": True,
+			"loaded": loaded,
+			"valid": valid,
+			"errors": errors,
+			"anomalies": anomalyObjects(found.anomalies)
+		}
+
+	def validate(self):
+
+		found = sinks.ListSink()
+		valid = db.validateDatabase(self.database, sink=found)
+
+		return {"ok": True, "valid": valid, "anomalies": anomalyObjects(found.anomalies)}
+
+	def lists(self):
+
+		return {"ok": True, "lists": anomalyObjects(db.iterLists(self.database))}
+
+	def counts(self):
+
+		curs = self.database.cursor()
+
+		return {
+			"ok": True,
+			"individuals": curs.execute("SELECT COUNT(*) FROM individuals").fetchone()[0],
+			"families": curs.execute("SELECT COUNT(*) FROM families").fetchone()[0]
+		}
+
+# Throw away the rest of a line that is longer than the reader's limit
+# Raises asyncio.IncompleteReadError if the connection ends first
+async def skipLine(reader):
+
+	while True:
+		try:
+			await reader.readuntil(b"\n")
+			return
+
+		except asyncio.LimitOverrunError as error:
+			await reader.readexactly(error.consumed)
+
+# Anomalies as JSON objects, with their messages
+def anomalyObjects(anomalies):
+
+	return [dict(sinks.anomalyObject(anomaly), message=anomaly.text()) for anomaly in anomalies]
+
+# Client side: connect to a service on host:port, or on the Unix socket path
+# Returns (reader, writer), the reader takes replies up to limit bytes long
+async def connect(host="127.0.0.1", port=8765, path=None, limit=lineLimit):
+
+	if path:
+		return await asyncio.open_unix_connection(path, limit=limit)
+
+	return await asyncio.open_connection(host, port, limit=limit)
+
+# Client side: send one request on a connection opened by connect and wait for its reply
+async def request(reader, writer, message):
+
+	writer.write((json.dumps(message) + "\n").encode())
+	await writer.drain()
+
+	return json.loads(await reader.readline())
+
+async def main(args):
+
+	service = Service(args.database, args.jobs, args.persist)
+	await service.start(args.host, args.port, args.socket)
+
+	print("listening on", service.address(), flush=True)
+
+	try:
+		await service.serveForever()
+	finally:
+		await service.close()
+
+if __name__ == "__main__":
+
+	argParser = argparse.ArgumentParser(description="Serve one GEDCOM database to local clients")
+	argParser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+	argParser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+	argParser.add_argument("--socket", default=None, help="listen on this Unix socket instead of a port")
+	argParser.add_argument("--database", default=":memory:",
+		help="database file to keep the records in (default: in memory)")
+	argParser.add_argument("--persist", action="store_true",
+		help="keep what is already in the database file instead of starting empty")
+	argParser.add_argument("-j", "--jobs", type=int, default=None,
+		help="worker processes used to parse the uploads (default: one per core)")
+	args = argParser.parse_args()
+
+	try:
+		asyncio.run(main(args))
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,102 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|Where anomalies and list rows go once the rules have found them                    |#
+#|A sink takes any iterable of GEDCOM_Records.Anomaly in write(). The validators and  |#
+#|lists write to the default sink unless they're given one.                          |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import sys
+import json
+import itertools
+
+# The message of each row, one per line
+# Lines are joined and written bufferLines at a time instead of printed one by one,
+# out is looked up on every write when not given (so it follows sys.stdout)
+class TextSink:
+
+	def __init__(self, out=None, bufferLines=4096):
+
+		self.out = out
+		self.bufferLines = bufferLines
+
+	def write(self, anomalies):
+
+		out = self.out or sys.stdout
+		anomalies = iter(anomalies)
+
+		while True:
+			lines = [anomaly.text() + "\n" for anomaly in itertools.islice(anomalies, self.bufferLines)]
+
+			if not lines:
+				break
+
+			out.write("".join(lines))
+
+# One JSON object per row, with the rule, kind, IDs, format string and its values
+# (the message itself isn't formatted)
+class JsonLinesSink:
+
+	def __init__(self, out=None, bufferLines=4096):
+
+		self.out = out
+		self.bufferLines = bufferLines
+
+	def write(self, anomalies):
+
+		out = self.out or sys.stdout
+		anomalies = iter(anomalies)
+
+		while True:
+			lines = [
+				json.dumps(anomalyObject(anomaly)) + "\n"
+				for anomaly in itertools.islice(anomalies, self.bufferLines)
+			]
+
+			if not lines:
+				break
+
+			out.write("".join(lines))
+
+# An anomaly as a dictionary that can be turned into JSON
+def anomalyObject(anomaly):
+
+	return {
+		"rule": anomaly.rule,
+		"kind": anomaly.kind,
+		"ids": list(anomaly.ids),
+		"template": anomaly.template,
+		"args": list(anomaly.args)
+	}
+
+# Keeps every row in anomalies, for callers that want the records themselves
+class ListSink:
+
+	def __init__(self):
+		self.anomalies = []
+
+	def write(self, anomalies):
+		self.anomalies.extend(anomalies)
+
+# Throws everything away
+class NullSink:
+
+	def write(self, anomalies):
+		pass
+
+# Sink class for each --anomalies format
+sinkFormats = {
+	"text": TextSink,
+	"jsonl": JsonLinesSink,
+	"none": NullSink
+}
+
+defaultSink = TextSink()
+
+# Where rows go when no sink is given, returns the sink it replaces
+def setDefault(sink):
+
+	global defaultSink
+
+	previous = defaultSink
+	defaultSink = sink
+
+	return previous
@@ -0,0 +1,156 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|Timers and counters for the parser, the loader, the validation rules and reports   |#
+#|Off by default. While off, a timer is a couple of attribute checks per phase and    |#
+#|nothing is counted per line, so leaving the calls in costs next to nothing.         |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import sys
+import json
+import time
+import threading
+
+from GEDCOM_Dates import parseDate
+
+enabled = False
+
+# name -> [seconds, calls]
+timers = {}
+
+# name -> count
+counters = {}
+
+# Queries on a GEDCOM_Database.ReaderPool record from several threads at once
+lock = threading.Lock()
+
+# Start recording, from zero
+def enable():
+
+	global enabled
+
+	reset()
+	enabled = True
+
+def disable():
+
+	global enabled
+
+	enabled = False
+
+def reset():
+
+	timers.clear()
+	counters.clear()
+	parseDate.cache_clear()
+
+# Add n to a counter
+def count(name, n=1):
+
+	if enabled:
+		with lock:
+			counters[name] = counters.get(name, 0) + n
+
+# Add to a timer
+def addTime(name, seconds):
+
+	if enabled:
+		with lock:
+			entry = timers.setdefault(name, [0.0, 0])
+			entry[0] += seconds
+			entry[1] += 1
+
+# Times the block it wraps: with stats.timer("load"): ...
+class timer:
+
+	__slots__ = ('name', 'start')
+
+	def __init__(self, name):
+		self.name = name
+		self.start = None
+
+	def __enter__(self):
+		if enabled:
+			self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if self.start is not None:
+			addTime(self.name, time.perf_counter() - self.start)
+
+# Pass items through, counting them under name
+# Only wrap an iterable with this while enabled, so a disabled run doesn't pay per item
+def counted(name, items):
+
+	n = 0
+
+	try:
+		for item in items:
+			n += 1
+			yield item
+
+	finally:
+		count(name, n)
+
+# Pass items through, timing how long it takes to get each one under name
+# (time spent by whoever consumes them isn't counted). Only wrap while enabled.
+def timedItems(name, items):
+
+	iterator = iter(items)
+	seconds = 0.0
+
+	try:
+		while True:
+			start = time.perf_counter()
+
+			try:
+				item = next(iterator)
+			except StopIteration:
+				break
+
+			seconds += time.perf_counter() - start
+			yield item
+
+	finally:
+		addTime(name, seconds)
+
+# Count every statement a connection runs, by its first word (queries.SELECT, queries.INSERT...)
+def watchQueries(conn):
+
+	def trace(statement):
+		words = statement.split(None, 1)
+		count("queries." + (words[0].upper() if words else "?"))
+
+	conn.set_trace_callback(trace)
+
+# Everything recorded so far
+# Returns {"timers": {name: {"seconds", "calls"}}, "counters": {name: count}}
+def summary():
+
+	dateCache = parseDate.cache_info()
+
+	return {
+		"timers": {name: {"seconds": seconds, "calls": calls} for (name, (seconds, calls)) in sorted(timers.items())},
+		"counters": dict(sorted(counters.items()), **{
+			"dates.parsed": dateCache.misses,
+			"dates.cached": dateCache.hits
+		})
+	}
+
+# Print the summary as a table (default: to standard error, away from the reports)
+def printSummary(out=None):
+
+	out = out or sys.stderr
+	stats = summary()
+
+	print("%-40s %12s %8s" % ("timer", "seconds", "calls"), file=out)
+	for (name, entry) in stats["timers"].items():
+		print("%-40s %12.4f %8d" % (name, entry["seconds"], entry["calls"]), file=out)
+
+	print("%-40s %12s" % ("counter", "count"), file=out)
+	for (name, n) in stats["counters"].items():
+		print("%-40s %12d" % (name, n), file=out)
+
+# Save the summary as JSON
+def writeJson(path):
+
+	with open(path, "w") as file:
+		json.dump(summary(), file, indent="\t")
@@ -5,8 +5,28 @@
 
 import unittest
 
+import io
+import contextlib
+import sqlite3
+import asyncio
+import os
+import csv
+import glob
+import json
+import shutil
+import tempfile
+
 import GEDCOM_Database as db
 import GEDCOM_Parser as parser
+import GEDCOM_Validator as validator
+import GEDCOM_Report as report
+import GEDCOM_Generator as generator
+import GEDCOM_Stats as stats
+import GEDCOM_Sinks as sinks
+import GEDCOM_Service as service
+import GEDCOM_Lineage as lineage
+from GEDCOM_Records import Individual, Family
+from GEDCOM_Dates import parseDate
 from prettytable import PrettyTable
 
 #all tests dealing with dates
@@ -237,6 +257,47 @@ class datesTest(unittest.TestCase):
         self.assertIn(("I01", "I02"), LargeAgeDifference) #husband age 2x wife age
         self.assertIn(("I04", "I03"), LargeAgeDifference) #wife age 2x husband age
 
+    # The date parser understands the GEDCOM date forms and never raises
+    def test_parseDate(self):
+        self.assertEqual(parseDate("25 APR 1950").isoformat(), "1950-04-25")
+        self.assertEqual(parseDate("25 APR 192").isoformat(), "0192-04-25")
+        self.assertEqual(parseDate("APR 1950").isoformat(), "1950-04-01")
+        self.assertEqual(parseDate("1950").isoformat(), "1950-01-01")
+        self.assertEqual(parseDate("ABT 1950").isoformat(), "1950-01-01")
+        self.assertEqual(parseDate("BEF 3 MAY 1950").isoformat(), "1950-05-03")
+        self.assertEqual(parseDate("BET 1950 AND 1960").isoformat(), "1950-01-01")
+        self.assertEqual(parseDate("FROM JAN 1950 TO DEC 1960").isoformat(), "1950-01-01")
+        self.assertEqual(parseDate("1699/00").isoformat(), "1699-01-01")
+
+        self.assertIsNone(parseDate("31 FEB 1950"))
+        self.assertIsNone(parseDate("(sometime in spring)"))
+        self.assertIsNone(parseDate("25 FOO 1950"))
+        self.assertIsNone(parseDate(""))
+        self.assertIsNone(parseDate("²"))
+        self.assertIsNone(parseDate("1 JAN ²"))
+        self.assertIsNone(parseDate("² JAN 1950"))
+
+        # dates compare directly and repeated dates aren't parsed again
+        self.assertLess(parseDate("24 APR 1950"), parseDate("25 APR 1950"))
+        self.assertIs(parseDate("25 APR 1950"), parseDate("25 APR 1950"))
+
+    # Partial dates load and are stored like full ones
+    def test_partialDates(self):
+
+        partial = '''
+            0 @I1@ INDI
+            1 NAME Partial /Dates/
+            1 SEX M
+            1 BIRT
+            2 DATE ABT 1919
+            1 DEAT
+            2 DATE BET MAR 1980 AND 1985
+            0 TRLR
+        '''
+
+        self.assertTrue(parser.parseText(self.database, partial))
+        self.assertEqual(db.getIndividual(self.database, "@I1@")[4:], ("1919-01-01", "1980-03-01"))
+
 #tests all user stories dealing with family relationships
 class familyTest(unittest.TestCase):
 
@@ -310,6 +371,73 @@ class familyTest(unittest.TestCase):
 
         self.assertFalse(parser.parseText(self.database, fam2))
 
+    # Families may come before the spouses they refer to
+    def test_familyFirst(self):
+
+        famFirst = '''
+            0 @F1@ FAM
+            1 HUSB @I3@
+            1 WIFE @I4@
+            1 MARR
+            2 DATE 19 APR 1960
+            0 @I3@ INDI
+            1 NAME Good /Guy1/
+            1 SEX M
+            1 BIRT
+            2 DATE 25 APR 1919
+            1 FAMS @F1@
+            0 @I4@ INDI
+            1 NAME Good /Girl1/
+            1 SEX F
+            1 BIRT
+            2 DATE 25 APR 1920
+            1 FAMS @F1@
+            0 TRLR
+        '''
+
+        self.assertTrue(parser.parseText(self.database, famFirst))
+        self.assertEqual(len(db.getFamilies(self.database)), 1)
+
+    # Files parsed in worker processes load exactly like files parsed one after another
+    def test_parallelFiles(self):
+
+        files = ["input/US16test.ged", "input/US28test.ged", "input/US18test.ged"]
+
+        sequential = db.dbInit(":memory:")
+        expected = all([parser.parseFile(sequential, path) for path in files])
+
+        self.assertEqual(parser.parseFiles(self.database, files, jobs=2), expected)
+        self.assertEqual(db.getIndividuals(self.database), db.getIndividuals(sequential))
+        self.assertEqual(db.getFamilies(self.database), db.getFamilies(sequential))
+
+        sequential.close()
+
+    # A file split at level 0 lines and parsed in pieces loads exactly like the whole file
+    def test_shardedFile(self):
+
+        path = "input/project03test.ged"
+
+        shards = parser.shardFile(path, 4)
+        self.assertEqual(len(shards), 4)
+
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        for (start, end) in shards:
+            self.assertTrue(data[start:end].startswith(b"0 "))
+
+        sequential = db.dbInit(":memory:")
+        expected = parser.parseFile(sequential, path)
+
+        self.assertEqual(parser.parseFileSharded(self.database, path, jobs=4), expected)
+        self.assertEqual(db.getIndividuals(self.database), db.getIndividuals(sequential))
+        self.assertEqual(db.getFamilies(self.database), db.getFamilies(sequential))
+        self.assertEqual(
+            self.database.execute("SELECT * FROM children ORDER BY childID, famID").fetchall(),
+            sequential.execute("SELECT * FROM children ORDER BY childID, famID").fetchall())
+
+        sequential.close()
+
     # US32 - Asserts that printMultipleBirths prints the triplets in the test file
     def test_multipleBirths(self):
         self.assertTrue(parser.parseFile(self.database, "input/US32test.ged"))
@@ -411,6 +539,739 @@ class miscTest(unittest.TestCase):
         self.assertTrue(parser.parseText(self.database, guy1))
         self.assertFalse(parser.parseText(self.database, guy2))
 
+    # Records are handed off as soon as the next level 0 line is read
+    def test_streamingRecords(self):
+
+        with open("input/project03test.ged") as file:
+            lines = iter(file.read().splitlines())
+
+        records = parser.parseRecords(lines)
+
+        record = next(records)
+        self.assertIsInstance(record, Individual)
+        self.assertEqual(record.id, "I01")
+
+        # the rest of the file has not been read yet
+        self.assertIsNotNone(next(lines, None))
+
+    # Dates are read by the event they belong to, whatever lines come in between
+    def test_tagDispatch(self):
+
+        lines = '''
+            0 I1 INDI
+            1 NAME Jane /Doe/
+            1 SEX F
+            1 BIRT
+            2 PLAC Hoboken
+            2 SOUR Parish register
+            2 DATE 1 MAR 1901
+            1 NOTE Moved away
+            2 DATE 2 MAR 1999
+            1 DEAT
+            2 NOTE Unsure of the day
+            2 DATE ABT 1970
+            0 TRLR
+        '''.splitlines()
+
+        (ind,) = parser.parseRecords(lines)
+        self.assertEqual(ind.id, "I1")
+        self.assertEqual(ind.birth.isoformat(), "1901-03-01")
+        self.assertEqual(ind.death.isoformat(), "1970-01-01")
+
+        # events without a tag rule keep their dates, in both tokenizers
+        lines = '''
+            0 I2 INDI
+            1 NAME John /Doe/
+            1 SEX M
+            1 BIRT
+            2 DATE 1 JAN 1900
+            1 CHR
+            2 DATE 9 SEP 1905
+            1 DEAT
+            2 DATE 1 JAN 1950
+            1 BURI
+            2 DATE 5 JAN 1999
+            0 TRLR
+        '''
+
+        (ind,) = parser.parseRecords(lines.splitlines())
+        self.assertEqual((ind.birth.isoformat(), ind.death.isoformat()), ("1900-01-01", "1950-01-01"))
+
+        with tempfile.TemporaryDirectory() as directory:
+
+            filePath = os.path.join(directory, "events.ged")
+            with open(filePath, "w") as file:
+                file.write(lines)
+
+            self.assertEqual(list(parser.parseRecordsMapped(filePath)), [ind])
+
+    # Reading a file through a memory map finds the same records as reading it line by line
+    def test_mappedTokenizer(self):
+
+        for filePath in sorted(glob.glob("input/*.ged")):
+
+            with open(filePath) as file:
+                records = list(parser.parseRecords(file))
+
+            mapped = list(parser.parseRecordsMapped(filePath))
+            self.assertEqual(mapped, records)
+            self.assertEqual([getattr(record, "children", None) for record in mapped],
+                [getattr(record, "children", None) for record in records])
+
+        # and so does each piece of a sharded file
+        filePath = "input/project03test.ged"
+        shards = parser.shardFile(filePath, 3)
+        pieces = []
+        for (i, (start, end)) in enumerate(shards):
+            pieces.extend(parser.readShard(filePath, start, end, i == len(shards) - 1, mapped=True))
+
+        self.assertEqual(pieces, list(parser.parseRecordsMapped(filePath)))
+
+    # Records read back from the database work like the tuples they replace
+    def test_records(self):
+        self.assertTrue(parser.parseFile(self.database, "input/project03test.ged"))
+
+        ind = db.getIndividual(self.database, "I01")
+        self.assertIsInstance(ind, Individual)
+        self.assertEqual(ind.firstName, ind[1])
+        self.assertEqual(ind, tuple(ind))
+        self.assertEqual(len(ind), 6)
+
+        fam = db.getFamily(self.database, "F01")
+        self.assertIsInstance(fam, Family)
+        self.assertEqual((fam.husbID, fam.wifeID), fam[3:5])
+        self.assertEqual(len(fam), 5)
+
+    # Bulk loads still report rows the database rejects, without losing the good ones
+    def test_bulkLoader(self):
+
+        loader = db.BulkLoader(self.database, chunkSize=None)
+
+        self.assertTrue(loader.addIndividual(Individual("I1", "Good", "Guy", "M", "1919-04-25", None)))
+        self.assertTrue(loader.addIndividual(Individual("I2", "Good", "Girl", "F", "1920-04-25", None)))
+        self.assertFalse(loader.addIndividual(Individual("I1", "Dupe", "Guy", "M", "1919-04-25", None)))
+        self.assertTrue(loader.addFamily(Family("F1", "1940-04-19", None, "I1", "I2")))
+        self.assertTrue(loader.addChild("I3", "F1"))
+        self.assertTrue(loader.addChild("I3", "F1"))
+
+        # nothing is written until the loader is flushed
+        self.assertEqual(len(db.getIndividuals(self.database)), 0)
+
+        self.assertFalse(loader.close())
+        self.assertEqual(len(db.getIndividuals(self.database)), 2)
+        self.assertEqual(len(db.getFamilies(self.database)), 1)
+        self.assertEqual(self.database.execute("SELECT COUNT(*) FROM children").fetchone(), (1,))
+
+    # Rejected records can go to a list instead of stdout
+    def test_loaderErrors(self):
+
+        errors = []
+        records = [Individual("I1", "Good", "Guy", "M", "1919-04-25", None),
+            Individual("I1", "Dupe", "Guy", "M", "1919-04-25", None),
+            Family("F1", "1940-04-19", None, "I1", "I9")]
+
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            self.assertFalse(parser.loadRecords(self.database, records, onError=errors.append))
+
+        self.assertEqual(printed.getvalue(), "")
+        self.assertEqual(len(errors), 2)
+        self.assertIn("I1", errors[0])
+        self.assertIn("wife does not exist", errors[1])
+
+    # Duplicate and spouse checks don't cost a query per record
+    def test_loaderQueries(self):
+
+        statements = []
+        self.database.set_trace_callback(statements.append)
+
+        with open("input/project03test.ged") as file:
+            self.assertTrue(parser.loadRecords(self.database, parser.parseRecords(file)))
+
+        self.database.set_trace_callback(None)
+
+        selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+        self.assertEqual(len(selects), 2)
+
+    # The relationship queries only scan the table that drives them, every join is an index search
+    def test_queryPlans(self):
+
+        def plan(sql, params=()):
+            return [row[3] for row in self.database.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+        def indexesUsed(steps):
+            return {word for step in steps for word in step.split() if word in secondary}
+
+        secondary = {"childrenFam", "familiesHusb", "familiesWife"}
+
+        # a full run scans the driving table once and looks the rest up by ID
+        for (rule, sql, msg, keys) in db.validationRules:
+            if rule in ('US02', 'US05', 'US16', 'US18', 'US21'):
+                steps = plan(sql)
+                scans = [step for step in steps if step.startswith("SCAN")]
+                self.assertEqual(len(scans), 1, rule + ": " + str(steps))
+
+        for deferred in (False, True):
+
+            self.database.close()
+            self.database = db.dbInit("GEDCOM.db", deferIndexes=deferred)
+
+            # the second validation is incremental, it fills in the affected tables
+            for indID in ("I1", "I2"):
+                self.assertTrue(parser.parseText(self.database,
+                    "0 " + indID + " INDI\n1 NAME Jo /Doe/\n1 SEX F\n1 BIRT\n2 DATE 1 JAN 190" + indID[1] + "\n0 TRLR"))
+
+            expected = set() if deferred else secondary
+
+            # re-checking a spouse finds their families through the spouse indexes
+            for (rule, sql, msg, keys) in db.validationRules:
+                if rule in ('US02', 'US05', 'US21'):
+                    steps = plan(db.storeQuery(sql, keys, db.affectedFilter(keys)), (rule,))
+                    self.assertEqual(indexesUsed(steps), expected - {"childrenFam"}, rule + ": " + str(steps))
+
+            # so does finding what a change affects
+            self.assertEqual(indexesUsed(plan(db.affectedIndividualsQuery)), expected - {"familiesWife"})
+            self.assertEqual(indexesUsed(plan(db.affectedFamiliesQuery)), expected - {"childrenFam"})
+
+            # US28 and US32
+            self.assertEqual(indexesUsed(plan(db.childrenQuery, ("F01",))), expected & {"childrenFam"})
+            self.assertEqual(indexesUsed(plan(db.listRules[2][1])), expected & {"childrenFam"})
+
+    # Indexes can be left out until after a bulk load
+    def test_deferredIndexes(self):
+
+        self.database.close()
+        self.database = db.dbInit("GEDCOM.db", deferIndexes=True)
+
+        def plan():
+            return [row[3] for row in self.database.execute("EXPLAIN QUERY PLAN " + db.childrenQuery, ("F01",))]
+
+        self.assertIn("SCAN children", plan())
+
+        self.assertTrue(parser.parseFile(self.database, "input/project03test.ged"))
+        db.createIndexes(self.database)
+
+        self.assertIn("SEARCH children USING INDEX childrenFam (famID=?)", plan())
+
+    # The in-memory validator finds exactly what the SQL rules find
+    def test_inMemoryValidator(self):
+
+        for path in sorted(glob.glob("input/*.ged")):
+
+            self.database.close()
+            self.database = db.dbInit("GEDCOM.db")
+            with open(path) as file:
+                parser.loadRecords(self.database, parser.parseRecords(file))
+
+            anomalies = validator.findAnomalies(self.database)
+
+            for (rule, sql, msg, keys) in db.validationRules:
+                self.assertEqual(
+                    sorted(anomalies[rule]),
+                    sorted(self.database.execute(sql).fetchall()),
+                    path + ": " + rule)
+
+            self.assertEqual(validator.validateDatabase(self.database), db.validateDatabase(self.database))
+
+    # Validating after each fragment only re-checks the new records, but finds the same anomalies
+    def test_incrementalValidation(self):
+
+        for path in ("input/US16test.ged", "input/US18test.ged", "input/US21test.ged", "input/US05test.ged"):
+
+            self.database.close()
+            self.database = db.dbInit("GEDCOM.db")
+
+            # one fragment per record
+            fragments = [[]]
+            with open(path) as file:
+                for line in file:
+                    if line.startswith("0 ") and fragments[-1]:
+                        fragments[-1].append("0 TRLR")
+                        fragments.append([])
+                    fragments[-1].append(line)
+
+            for fragment in fragments:
+                valid = parser.parseText(self.database, "\n".join(fragment))
+
+            # the last call answers for the whole database, like a full run
+            self.assertFalse(valid)
+
+            # in the same order too
+            for (rule, sql, msg, keys) in db.validationRules:
+                self.assertEqual(
+                    db.getAnomalies(self.database, rule, keys),
+                    self.database.execute(sql).fetchall(),
+                    path + ": " + rule)
+
+        # a third person with the same name and birthday, in a later fragment
+        self.database.close()
+        self.database = db.dbInit("GEDCOM.db")
+
+        person = "0 {} INDI\n1 NAME Ann /Lee/\n1 SEX F\n1 BIRT\n2 DATE 1 JAN 1900\n"
+        parser.parseText(self.database, person.format("I1") + person.format("I2") + "0 TRLR")
+
+        incremental = sinks.ListSink()
+        self.assertFalse(db.validateChanges(self.database, incremental))
+        incremental.anomalies = []
+        parser.parseText(self.database, person.format("I3") + "0 TRLR", lambda conn: db.validateChanges(conn, incremental))
+
+        full = sinks.ListSink()
+        db.validateDatabase(self.database, sink=full)
+        self.assertEqual([anomaly.ids for anomaly in incremental.anomalies],
+            [("I1", "I2"), ("I1", "I3"), ("I2", "I1"), ("I2", "I3"), ("I3", "I1"), ("I3", "I2")])
+        self.assertEqual(incremental.anomalies, full.anomalies)
+
+
+    # A persistent database only loads files that changed since the last run
+    def test_persistentDatabase(self):
+
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+
+        dbPath = os.path.join(tempDir, "GEDCOM.db")
+        people = os.path.join(tempDir, "people.ged")
+        shutil.copy("input/project03test.ged", people)
+
+        database = db.dbInit(dbPath, persistent=True)
+        self.assertTrue(parser.parseChangedFiles(database, [people]))
+        individuals = db.getIndividuals(database)
+        database.close()
+
+        # unchanged, nothing is loaded again (a second load would be a US22 duplicate)
+        database = db.dbInit(dbPath, persistent=True)
+        self.assertTrue(parser.parseChangedFiles(database, [people]))
+        self.assertEqual(db.getIndividuals(database), individuals)
+        database.close()
+
+        # changed, the old records are replaced
+        with open(people) as file:
+            text = file.read()
+        with open(people, "w") as file:
+            file.write(text.replace("1 NAME Richard /Johnson/", "1 NAME Dick /Johnson/"))
+
+        database = db.dbInit(dbPath, persistent=True)
+        self.assertTrue(parser.parseChangedFiles(database, [people]))
+        self.assertEqual(len(db.getIndividuals(database)), len(individuals))
+        self.assertEqual(db.getIndividual(database, "I01").firstName, "Dick")
+        database.close()
+
+    # A snapshot loads back the same rows, and the same anomalies, as parsing the file
+    def test_snapshot(self):
+
+        tempDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempDir)
+        snapshot = os.path.join(tempDir, "tree.snap")
+
+        self.assertFalse(parser.parseFile(self.database, "input/US05test.ged"))
+        counts = db.exportSnapshot(self.database, snapshot)
+        self.assertEqual(counts, {"individuals": 5, "families": 1, "children": 3})
+
+        loaded = db.dbInit(":memory:")
+        self.addCleanup(loaded.close)
+        self.assertTrue(db.importSnapshot(loaded, snapshot))
+
+        for table in ("individuals", "families", "children"):
+            self.assertEqual(loaded.execute("SELECT * FROM " + table).fetchall(),
+                self.database.execute("SELECT * FROM " + table).fetchall())
+
+        self.assertFalse(db.validateChanges(loaded))
+
+        # loading it twice would duplicate every ID
+        self.assertFalse(db.importSnapshot(loaded, snapshot))
+
+        with open(snapshot, "rb") as file:
+            data = file.read()
+        with open(snapshot, "wb") as file:
+            file.write(data[:len(data) // 2])
+
+        self.assertFalse(db.importSnapshot(db.dbInit(":memory:"), snapshot))
+
+    # The streaming report formats hold the same rows as the table
+    def test_reportFormats(self):
+        self.assertTrue(parser.parseFile(self.database, "input/US28test.ged"))
+
+        individuals = db.getIndividuals(self.database)
+        families = db.getFamilies(self.database)
+
+        out = io.StringIO()
+        report.writeDatabase(self.database, "csv", out)
+        (indSection, famSection, end) = out.getvalue().split("\n\n")
+        indRows = list(csv.reader(io.StringIO(indSection)))
+        self.assertEqual(indRows[0], [title for (key, title, width) in report.individualColumns])
+        self.assertEqual(indRows[1:], [[cell or "" for cell in ind] for ind in individuals])
+        self.assertEqual(len(list(csv.reader(io.StringIO(famSection)))), len(families) + 1)
+
+        out = io.StringIO()
+        report.writeDatabase(self.database, "jsonl", out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record["id"] for record in records if record["table"] == "individuals"],
+            [ind.id for ind in individuals])
+        self.assertEqual([record["children"] for record in records if record["table"] == "families"],
+            [[x[0] for x in db.getChildren(self.database, fam.id)] for fam in families])
+
+        out = io.StringIO()
+        report.writeDatabase(self.database, "fixed", out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2 + len(individuals) + 1 + 2 + len(families) + 1)
+        self.assertTrue(lines[2].startswith(individuals[0].id.ljust(10) + " "))
+
+        # rows are written as they come, not when the report is finished
+        def rows():
+            yield ["I1", "Good", "Guy", "M", "1919-04-25", None]
+            self.assertIn("Good", out.getvalue())
+
+        out = io.StringIO()
+        self.assertEqual(report.writeReport(out, "csv", "individuals", report.individualColumns, rows()), 1)
+
+    # The family report is one query, with the same rows as looking each family's people up
+    def test_familyReport(self):
+        self.assertTrue(parser.parseFile(self.database, "input/US28test.ged"))
+
+        expected = []
+        for fam in db.getFamilies(self.database):
+            husb = db.getIndividual(self.database, fam.husbID)
+            wife = db.getIndividual(self.database, fam.wifeID)
+            expected.append([fam.id, fam.married, fam.divorced,
+                fam.husbID, husb.firstName, husb.lastName,
+                fam.wifeID, wife.firstName, wife.lastName,
+                [x[0] for x in db.getChildren(self.database, fam.id)]])
+
+        statements = []
+        self.database.set_trace_callback(statements.append)
+        rows = list(db.familyReportRows(self.database))
+        self.database.set_trace_callback(None)
+
+        self.assertEqual(rows, expected)
+        self.assertEqual(len(statements), 1)
+
+    # Generated trees are the same for the same seed, and only have the anomalies asked for
+    def test_generator(self):
+
+        lines = list(generator.generateLines(500, seed=7))
+        self.assertEqual(lines, list(generator.generateLines(500, seed=7)))
+        self.assertNotEqual(lines, list(generator.generateLines(500, seed=8)))
+
+        self.assertTrue(parser.parseLines(self.database, lines))
+        self.assertGreaterEqual(len(db.getIndividuals(self.database)), 500)
+
+        self.database.close()
+        self.database = db.dbInit("GEDCOM.db")
+
+        self.assertFalse(parser.parseLines(self.database,
+            generator.generateLines(500, seed=7, anomalies={"US02": 0.2, "US21": 0.2})))
+
+        found = validator.findAnomalies(self.database)
+        self.assertGreater(len(found["US02"]), 0)
+        self.assertGreater(len(found["US21"]), 0)
+        self.assertEqual(found["US18"], [])
+
+        # future births don't depend on today's date
+        future = [line for line in generator.generateLines(500, seed=7, anomalies={"US01": 0.2}) if "DATE" in line]
+        self.assertTrue(any(int(line.split()[-1]) >= generator.futureYear for line in future))
+
+        # a cousin picked for US19 is listed under both of his parents' families, but marries once
+        for seed in range(4):
+            lines = generator.generateLines(10000, seed=seed, anomalies={"US19": 1.0})
+            spouses = [line.split()[-1] for line in lines if line.startswith(("1 HUSB", "1 WIFE"))]
+            self.assertEqual(len(spouses), len(set(spouses)))
+
+    # Stats count what a run did while enabled, and nothing while disabled
+    def test_stats(self):
+
+        stats.enable()
+        self.addCleanup(stats.disable)
+
+        self.database.close()
+        self.database = db.dbInit("GEDCOM.db")
+
+        self.assertFalse(parser.parseFile(self.database, "input/US05test.ged"))
+
+        with open("input/US05test.ged") as file:
+            lineCount = len(file.readlines())
+
+        summary = stats.summary()
+        self.assertEqual(summary["counters"]["lines"], lineCount)
+        self.assertEqual(summary["counters"]["inserted.individuals"], 5)
+        self.assertEqual(summary["counters"]["inserted.children"], 3)
+        self.assertEqual(summary["counters"]["anomalies.US05"], 1)
+        self.assertGreater(summary["counters"]["queries.SELECT"], 0)
+        self.assertIn("validate.US05", summary["timers"])
+        self.assertIn("load.insert", summary["timers"])
+        self.assertIn("parse.tokenize", summary["timers"])
+        self.assertGreater(summary["timers"]["parse.dates"]["calls"], 0)
+
+        stats.disable()
+        stats.reset()
+
+        parser.parseFile(self.database, "input/McClusky.ged")
+        self.assertEqual(stats.summary()["timers"], {})
+        self.assertNotIn("lines", stats.summary()["counters"])
+
+    # Rules hand their rows to a sink as Anomaly records, text is only made by the text sink
+    def test_anomalySinks(self):
+
+        twins = '''
+            0 @I3@ INDI
+            1 NAME Good /Guy/
+            1 SEX M
+            1 BIRT
+            2 DATE 25 APR 1919
+            1 DEAT
+            2 DATE 13 SEP 1939
+            0 @I4@ INDI
+            1 NAME Good /Guy/
+            1 SEX M
+            1 BIRT
+            2 DATE 25 APR 1919
+            0 TRLR
+        '''
+
+        parser.loadRecords(self.database, parser.parseRecords(twins.splitlines()))
+
+        collected = sinks.ListSink()
+        self.assertFalse(db.validateDatabase(self.database, sink=collected))
+
+        duplicates = [anomaly for anomaly in collected.anomalies if anomaly.rule == "US23"]
+        self.assertEqual(sorted([anomaly.ids for anomaly in duplicates]), [("@I3@", "@I4@"), ("@I4@", "@I3@")])
+        self.assertEqual(duplicates[0].kind, "ANOMALY")
+        self.assertTrue(duplicates[0].text().startswith("ANOMALY: US23: "))
+        self.assertEqual(list(db.iterAnomalies(self.database)), collected.anomalies)
+
+        out = io.StringIO()
+        db.validateDatabase(self.database, sink=sinks.JsonLinesSink(out))
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record["ids"] for record in records], [list(anomaly.ids) for anomaly in collected.anomalies])
+
+        out = io.StringIO()
+        db.validateDatabase(self.database, sink=sinks.TextSink(out, bufferLines=1))
+        self.assertEqual(out.getvalue().splitlines(), [anomaly.text() for anomaly in collected.anomalies])
+
+        # lists still return their rows with nothing written
+        deceased = db.printDeceased(self.database, sinks.NullSink())
+        self.assertEqual(len(deceased), len([row for row in db.iterLists(self.database) if row.rule == "US29"]))
+
+    # The iter* functions stream the same rows as the get* ones, pages walk every record once
+    def test_lazyQueries(self):
+
+        parser.loadRecords(self.database, parser.parseRecords(generator.generateLines(200, seed=3)))
+
+        individuals = db.getIndividuals(self.database)
+        self.assertEqual(list(db.iterIndividuals(self.database, batchSize=7)), individuals)
+        self.assertEqual(list(db.iterFamilies(self.database)), db.getFamilies(self.database))
+
+        for fam in db.getFamilies(self.database):
+            self.assertEqual(list(db.iterChildren(self.database, fam.id, 1)), db.getChildren(self.database, fam.id))
+
+        first = db.pageIndividuals(self.database, limit=10)
+        self.assertEqual(len(first), 10)
+        self.assertEqual(db.pageIndividuals(self.database, first[4].id, 5), first[5:])
+
+        paged = list(db.iterPages(self.database, db.pageIndividuals, 16))
+        self.assertEqual(paged, sorted(individuals, key=lambda ind: ind.id))
+        self.assertEqual(db.pageIndividuals(self.database, paged[-1].id), [])
+
+        families = list(db.iterPages(self.database, db.pageFamilies, 16))
+        self.assertEqual(families, db.getFamilies(self.database))
+
+    # The service answers several local clients at once from one database
+    def test_service(self):
+
+        with open("input/US05test.ged") as file:
+            text = file.read()
+
+        async def session():
+
+            server = service.Service(jobs=2)
+            await server.start()
+            (host, port) = server.address()
+
+            try:
+                clients = [await service.connect(host, port) for i in range(4)]
+
+                replies = await asyncio.gather(*[
+                    service.request(reader, writer, {"op": "load", "text": text})
+                    for (reader, writer) in clients
+                ])
+
+                (reader, writer) = clients[0]
+                counts = await service.request(reader, writer, {"op": "counts"})
+                validated = await service.request(reader, writer, {"op": "validate"})
+                bad = await service.request(reader, writer, {"op": "nothing"})
+                broken = await service.request(reader, writer, {"text": text})
+                # the parse fails in a worker, the reply still comes back
+                wrongType = await asyncio.wait_for(
+                    service.request(reader, writer, {"op": "load", "text": 5}), 30)
+                stillUp = await service.request(reader, writer, {"op": "counts"})
+
+                for (reader, writer) in clients:
+                    writer.close()
+                    await writer.wait_closed()
+
+            finally:
+                await server.close()
+
+            return (replies, counts, validated, bad, broken, wrongType, stillUp)
+
+        (replies, counts, validated, bad, broken, wrongType, stillUp) = asyncio.run(session())
+
+        # the first load to reach the database adds the records, the others are duplicates
+        self.assertEqual(sorted([reply["loaded"] for reply in replies]), [False, False, False, True])
+        self.assertTrue(all(reply["errors"] for reply in replies if not reply["loaded"]))
+
+        for reply in replies:
+            self.assertFalse(reply["valid"])
+            self.assertEqual([anomaly["rule"] for anomaly in reply["anomalies"]], ["US05"])
+
+        self.assertEqual((counts["individuals"], counts["families"]), (5, 1))
+        self.assertEqual(validated["anomalies"], replies[0]["anomalies"])
+        self.assertIn("Individual I01 was married after their death", validated["anomalies"][0]["message"])
+        self.assertFalse(bad["ok"])
+        self.assertFalse(broken["ok"])
+        self.assertFalse(wrongType["ok"])
+        self.assertEqual(stillUp, counts)
+
+    # A persistent service keeps SQLite's safe journal and sync settings
+    def test_servicePersistent(self):
+
+        async def pragmas(path, persistent):
+
+            server = service.Service(path, jobs=1, persistent=persistent)
+            await server.start()
+
+            try:
+                return await server.onDatabase(lambda: (
+                    server.database.execute("PRAGMA journal_mode").fetchone()[0],
+                    server.database.execute("PRAGMA synchronous").fetchone()[0]))
+            finally:
+                await server.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "service.db")
+
+            self.assertEqual(asyncio.run(pragmas(path, False)), ("memory", 0))
+            self.assertEqual(asyncio.run(pragmas(path, True)), ("delete", 2))
+
+    # Requests and replies over asyncio's default 64 KiB line limit, and one over the service's limit
+    def test_serviceLargeRequests(self):
+
+        text = "\n".join(generator.generateLines(3000, seed=4, anomalies={"US23": 0.05}))
+        self.assertGreater(len(text), 64 * 1024)
+
+        async def session():
+
+            server = service.Service(jobs=1)
+            await server.start()
+            small = service.Service(jobs=1, limit=1024)
+            await small.start()
+
+            try:
+                (reader, writer) = await service.connect(*server.address())
+                loaded = await service.request(reader, writer, {"op": "load", "text": text})
+                lists = await service.request(reader, writer, {"op": "lists"})
+                writer.close()
+
+                (reader, writer) = await service.connect(*small.address())
+                refused = await service.request(reader, writer, {"op": "load", "text": text})
+                counts = await service.request(reader, writer, {"op": "counts"})
+                writer.close()
+
+            finally:
+                await server.close()
+                await small.close()
+
+            return (loaded, lists, refused, counts)
+
+        (loaded, lists, refused, counts) = asyncio.run(session())
+
+        self.assertTrue(loaded["ok"])
+        self.assertTrue(loaded["loaded"])
+        self.assertIn("US23", [anomaly["rule"] for anomaly in loaded["anomalies"]])
+        self.assertGreater(len(json.dumps(lists)), 64 * 1024)
+        self.assertFalse(refused["ok"])
+        self.assertIn("limit", refused["error"])
+        self.assertEqual((counts["ok"], counts["individuals"]), (True, 0))
+
+    # Queries run on a pool of readers give the same results, in the same order, as on one connection
+    def test_readerPool(self):
+
+        self.database.close()
+        self.database = db.dbInit("GEDCOM.db", wal=True)
+
+        parser.loadRecords(self.database, parser.parseRecords(
+            generator.generateLines(300, seed=5, anomalies={"US02": 0.1, "US16": 0.1, "US23": 0.05})))
+
+        expected = sinks.ListSink()
+        db.validateDatabase(self.database, sink=expected)
+
+        with db.ReaderPool("GEDCOM.db", 3) as pool:
+
+            found = sinks.ListSink()
+            self.assertFalse(db.validatePooled(pool, found))
+            self.assertEqual(found.anomalies, expected.anomalies)
+
+            lists = db.printListsPooled(pool, sinks.NullSink())
+            self.assertEqual(lists, [
+                db.printDeceased(self.database, sinks.NullSink()),
+                db.printLivingMarried(self.database, sinks.NullSink()),
+                db.printMultipleBirths(self.database, sinks.NullSink()),
+                db.printOrphans(self.database, sinks.NullSink()),
+                db.printLargeAgeDifferences(self.database, sinks.NullSink())
+            ])
+
+            (single, singleLists) = (io.StringIO(), sinks.ListSink())
+            (pooled, pooledLists) = (io.StringIO(), sinks.ListSink())
+            parser.printDatabase(self.database, "csv", single, singleLists)
+            parser.printDatabase(self.database, "csv", pooled, pooledLists, pool)
+            self.assertEqual(pooled.getvalue(), single.getvalue())
+            self.assertEqual(pooledLists.anomalies, singleLists.anomalies)
+
+            # readers see what the writer has committed, and can't write themselves
+            count = db.queryAll(pool, ["SELECT COUNT(*) FROM individuals"])[0][0][0]
+            parser.loadRecords(self.database, parser.parseRecords(
+                ["0 @X1@ INDI", "1 NAME New /Person/", "1 SEX F", "1 BIRT", "2 DATE 1 JAN 2000", "0 TRLR"]))
+            self.assertEqual(db.queryAll(pool, ["SELECT COUNT(*) FROM individuals"])[0][0][0], count + 1)
+
+            with self.assertRaises(sqlite3.OperationalError):
+                db.queryAll(pool, ["DELETE FROM individuals"])
+
+    # Ancestors, descendants and relationships from the lineage index
+    def test_lineage(self):
+
+        # two first cousins, children of a brother and a sister, marry
+        tree = lineage.Lineage(
+            ["G1", "G2", "P1", "P2", "S1", "S2", "C1", "C2", "K1"],
+            [("F1", "G1", "G2"), ("F2", "P1", "S1"), ("F3", "S2", "P2"), ("F4", "C1", "C2")],
+            [("P1", "F1"), ("P2", "F1"), ("C1", "F2"), ("C2", "F3"), ("K1", "F4")])
+
+        self.assertEqual(tree.kinship("C1", "C2"), (2, 2, ["G1", "G2"]))
+        self.assertEqual(tree.relationship("C1", "C2"), "first cousin")
+        self.assertEqual(tree.relationship("G1", "C1"), "grandparent")
+        self.assertEqual(tree.relationship("K1", "G2"), "great-grandchild")
+        self.assertEqual(tree.relationship("P1", "C2"), "aunt/uncle")
+        self.assertEqual(tree.relationship("C1", "P2"), "niece/nephew")
+        self.assertEqual(tree.relationship("K1", "P1"), "grandchild")
+        self.assertIsNone(tree.relationship("S1", "S2"))
+        self.assertEqual(lineage.relationshipName(2, 3), "first cousin once removed")
+        self.assertEqual(lineage.relationshipName(5, 12), "fourth cousin 7 times removed")
+
+        self.assertEqual(tree.ancestors("K1", 2), [("C1", 1), ("C2", 1), ("P1", 2), ("S1", 2), ("S2", 2), ("P2", 2)])
+        self.assertEqual(sorted(tree.descendants("G1")),
+            [("C1", 2), ("C2", 2), ("K1", 3), ("P1", 1), ("P2", 1)])
+
+        self.assertEqual(list(tree.cousinMarriages()), [("F4", "C1", "C2", "first cousin", ["G1", "G2"])])
+        self.assertEqual(list(tree.cousinMarriages(0)), [])
+
+        # generated cousin marriages are found, and nothing further apart than asked for
+        parser.loadRecords(self.database, parser.parseRecords(
+            generator.generateLines(3000, seed=2, anomalies={"US18": 0.05, "US19": 0.5}, deep=True)))
+
+        index = lineage.loadLineage(self.database)
+        marriages = list(index.cousinMarriages())
+
+        self.assertEqual(len(index), len(db.getIndividuals(self.database)))
+        self.assertIn("first cousin", [marriage[3] for marriage in marriages])
+        self.assertLessEqual(set([marriage[3] for marriage in marriages]), {"sibling", "first cousin"})
+        self.assertEqual(len(list(index.cousinMarriages(0))), len(validator.findAnomalies(self.database)["US18"]))
 
 
 unittest.main()
@@ -0,0 +1,150 @@
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+#|In-memory validation engine                                                        |#
+#|Reads the individuals, families and child links once, then checks the same rules  |#
+#|as GEDCOM_Database.validateDatabase in one pass over each table instead of one SQL |#
+#|query per rule. The SQL engine stays in GEDCOM_Database for cross-checking.        |#
+#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#
+
+import GEDCOM_Database as db
+import GEDCOM_Stats as stats
+
+# SQL comparison, false when either side is NULL
+def after(date1, date2):
+	return date1 is not None and date2 is not None and date1 > date2
+
+# Read every table into memory
+# Returns (Individual records by ID, list of Family records, list of (childID, famID) links)
+def loadTables(conn):
+
+	individuals = {}
+	for ind in db.individualCursor(conn).execute('SELECT * FROM individuals'):
+		individuals[ind.id] = ind
+
+	families = db.familyCursor(conn).execute('SELECT * FROM families').fetchall()
+	children = conn.cursor().execute('SELECT childID, famID FROM children').fetchall()
+
+	return (individuals, families, children)
+
+# Find every anomaly in the database
+# Returns a dictionary from rule ID (as in GEDCOM_Database.validationRules) to the rows that rule
+# would have returned
+def findAnomalies(conn):
+
+	(individuals, families, children) = loadTables(conn)
+
+	# same clock as the SQL rules
+	today = conn.cursor().execute("SELECT DATE('now')").fetchone()[0]
+
+	anomalies = {}
+	for (rule, sql, msg, keys) in db.validationRules:
+		anomalies[rule] = []
+
+	familiesByID = {}
+	childFams = {}
+	for (childID, famID) in children:
+		childFams.setdefault(childID, []).append(famID)
+
+	sameNameBirth = {}
+
+	# Individuals
+	for ind in individuals.values():
+
+		#US01 - dates before current date
+		if after(ind.birth, today):
+			anomalies['US01-birth'].append((ind.id,))
+		if after(ind.death, today):
+			anomalies['US01-death'].append((ind.id,))
+
+		#US03 - death before birth
+		if after(ind.birth, ind.death):
+			anomalies['US03'].append((ind.id,))
+
+		#US23 - group by name and birthday, pairs are found below
+		if (ind.firstName is not None and ind.lastName is not None and ind.birth is not None):
+			key = (ind.firstName, ind.lastName, ind.birth)
+			sameNameBirth.setdefault(key, []).append(ind.id)
+
+	# Families
+	for fam in families:
+
+		familiesByID[fam.id] = fam
+
+		#US01 - dates before current date
+		if after(fam.married, today):
+			anomalies['US01-married'].append((fam.id,))
+		if after(fam.divorced, today):
+			anomalies['US01-divorced'].append((fam.id,))
+
+		#US04 - marriage before divorce
+		if fam.divorced is not None and fam.married is not None and fam.divorced <= fam.married:
+			anomalies['US04'].append((fam.id,))
+
+		# each spouse once, even if the same person is listed as both
+		spouses = [fam.husbID]
+		if fam.wifeID != fam.husbID:
+			spouses.append(fam.wifeID)
+
+		for spouseID in spouses:
+
+			spouse = individuals.get(spouseID)
+			if spouse is None:
+				continue
+
+			#US02 - birth before marriage
+			if spouse.birth is not None and fam.married is not None and spouse.birth >= fam.married:
+				anomalies['US02'].append((spouseID,))
+
+			#US05 - marriage before death
+			if after(fam.married, spouse.death):
+				anomalies['US05'].append((spouseID,))
+
+			#US21 - correct gender for role
+			if ((spouseID == fam.husbID and spouse.gender == "F") or
+				(spouseID == fam.wifeID and spouse.gender == "M")):
+				anomalies['US21'].append((spouseID,))
+
+		#US18 - siblings should not marry
+		for husbFam in childFams.get(fam.husbID, []):
+			for wifeFam in childFams.get(fam.wifeID, []):
+				if husbFam == wifeFam:
+					anomalies['US18'].append((fam.id,))
+
+	# Child links
+	for (childID, famID) in children:
+
+		#US16 - male last names
+		child = individuals.get(childID)
+		fam = familiesByID.get(famID)
+		if child is None or fam is None:
+			continue
+
+		father = individuals.get(fam.husbID)
+		if father is None:
+			continue
+
+		if (child.gender == "M" and father.lastName is not None and
+			child.lastName is not None and father.lastName != child.lastName):
+			anomalies['US16'].append((childID,))
+
+	#US23 - Unique Name and Births
+	for ids in sameNameBirth.values():
+		for id1 in ids:
+			for id2 in ids:
+				if id1 != id2:
+					anomalies['US23'].append((id1, id2))
+
+	return anomalies
+
+# Same as GEDCOM_Database.validateDatabase, writes each anomaly found to the sink
+# (default: GEDCOM_Sinks.defaultSink) and returns false if there were any
+def validateDatabase(conn, sink=None):
+
+	with stats.timer("validate.memory"):
+		anomalies = findAnomalies(conn)
+
+	noerrors = True
+
+	for (rule, sql, msg, keys) in db.validationRules:
+		noerrors &= len(db.printRows(anomalies[rule], msg, rule, keys, "ANOMALY", sink)) == 0
+
+	return noerrors